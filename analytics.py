@@ -0,0 +1,177 @@
+"""
+Per-player stats over recorded hand histories, in one streaming pass. Records are read straight
+out of the memory-mapped segments with struct, so memory stays flat however many hands there are,
+and segments are sharded across worker processes whose partial stats are merged at the end.
+
+    VPIP         share of hands with a voluntary call or raise before the flop
+    PFR          share of hands with a raise before the flop
+    aggression   raises / calls, over every street
+    showdown     share of showdowns won (ties count as wins), re-scored with the lookup evaluator
+"""
+
+from __future__ import annotations
+import argparse
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Iterable, Optional, Union
+from history import ACTION, HAND, NAME, SEAT, HistoryReader, segments
+from main import evaluate_ids
+
+Stats = dict[str, "PlayerStats"]
+
+
+@dataclass
+class PlayerStats:
+    hands: int = 0
+    vpip_hands: int = 0
+    pfr_hands: int = 0
+    raises: int = 0
+    calls: int = 0
+    showdowns: int = 0
+    showdowns_won: int = 0
+    net_chips: int = 0
+
+    @property
+    def vpip(self) -> float:
+        return self.vpip_hands / self.hands if self.hands else 0.0
+
+    @property
+    def pfr(self) -> float:
+        return self.pfr_hands / self.hands if self.hands else 0.0
+
+    @property
+    def aggression(self) -> float:
+        if not self.calls:
+            return math.inf if self.raises else 0.0
+        return self.raises / self.calls
+
+    @property
+    def showdown_win_rate(self) -> float:
+        return self.showdowns_won / self.showdowns if self.showdowns else 0.0
+
+    def merge(self, other: PlayerStats) -> PlayerStats:
+        for f in fields(self):
+            setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+
+        return self
+
+
+def merge(into: Stats, other: Stats) -> Stats:
+    for name, player_stats in other.items():
+        into.setdefault(name, PlayerStats()).merge(player_stats)
+
+    return into
+
+
+def _scan_hand(body: memoryview, stats: Stats):
+    _, seats, board_len, action_count, _, _, _ = HAND.unpack_from(body)
+    pos: int = HAND.size
+    rows: list[tuple[int, int, int, int, int]] = [
+        SEAT.unpack_from(body, pos + seat * SEAT.size) for seat in range(seats)
+    ]
+    pos += seats * SEAT.size
+    board: list[int] = list(body[pos : pos + board_len])
+    pos += board_len
+
+    vpip: list[bool] = [False] * seats
+    pfr: list[bool] = [False] * seats
+    raises: list[int] = [0] * seats
+    calls: list[int] = [0] * seats
+    end: int = pos + action_count * ACTION.size
+    for street, seat, code, _ in ACTION.iter_unpack(body[pos:end]):
+        if code == 2:
+            calls[seat] += 1
+            vpip[seat] = vpip[seat] or street == 0
+        elif code == 3:
+            raises[seat] += 1
+            if street == 0:
+                vpip[seat] = pfr[seat] = True
+    pos = end
+
+    # re-score the showdown rather than trusting the recorded chip movements
+    winners: set[int] = set()
+    at_showdown: list[int] = [seat for seat, row in enumerate(rows) if row[4]]
+    if len(at_showdown) > 1 and board_len == 5:
+        strengths: dict[int, int] = {
+            seat: evaluate_ids([rows[seat][2], rows[seat][3], *board]) for seat in at_showdown
+        }
+        best: int = max(strengths.values())
+        winners = {seat for seat, strength in strengths.items() if strength == best}
+    else:
+        at_showdown = []
+
+    for seat, (stack, chips, _, _, _) in enumerate(rows):
+        (length,) = NAME.unpack_from(body, pos)
+        name: str = bytes(body[pos + 1 : pos + 1 + length]).decode()
+        pos += 1 + length
+
+        player_stats: Optional[PlayerStats] = stats.get(name)
+        if player_stats is None:
+            player_stats = stats[name] = PlayerStats()
+        player_stats.hands += 1
+        player_stats.vpip_hands += vpip[seat]
+        player_stats.pfr_hands += pfr[seat]
+        player_stats.raises += raises[seat]
+        player_stats.calls += calls[seat]
+        player_stats.net_chips += chips - stack
+        if seat in at_showdown:
+            player_stats.showdowns += 1
+            player_stats.showdowns_won += seat in winners
+
+
+def scan(records: Iterable[Union[bytes, memoryview]]) -> Stats:
+    """
+    Stats over a stream of record bodies, e.g. HistoryReader.records(). Nothing but the running
+    totals is kept between records.
+    """
+    stats: Stats = {}
+    for body in records:
+        _scan_hand(memoryview(body), stats)
+
+    return stats
+
+
+def _scan_segments(paths: list[Path]) -> Stats:
+    return scan(HistoryReader.from_paths(paths).records())
+
+
+def analyze(
+    directory: Union[str, Path], prefix: Optional[str] = None, *, workers: Optional[int] = None
+) -> Stats:
+    """
+    Stats over every hand in the directory. Segments are dealt round-robin to worker processes
+    and the partial stats merged; workers=0 scans them in this process.
+    """
+    paths: list[Path] = segments(directory, prefix)
+    shards: int = max(1, min(len(paths), workers if workers is not None else os.cpu_count() or 1))
+    groups: list[list[Path]] = [paths[i::shards] for i in range(shards)]
+
+    if workers == 0:
+        partials: list[Stats] = [_scan_segments(group) for group in groups]
+    else:
+        with ProcessPoolExecutor(max_workers=shards) as pool:
+            partials = list(pool.map(_scan_segments, groups))
+
+    stats: Stats = {}
+    for partial in partials:
+        merge(stats, partial)
+
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-player stats over a hand history")
+    parser.add_argument("directory")
+    parser.add_argument("--prefix", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    print(f"{'player':<16}{'hands':>10}{'VPIP':>8}{'PFR':>8}{'AF':>8}{'W$SD':>8}{'net':>12}")
+    for name, player in sorted(analyze(args.directory, args.prefix, workers=args.workers).items()):
+        print(
+            f"{name:<16}{player.hands:>10}{player.vpip:>8.1%}{player.pfr:>8.1%}"
+            f"{player.aggression:>8.2f}{player.showdown_win_rate:>8.1%}{player.net_chips:>+12}"
+        )
@@ -0,0 +1,62 @@
+"""
+Vectorized hand evaluation over NumPy arrays of card ids, built from the same lookup tables as
+main.evaluate_ids so the results match it exactly.
+"""
+
+import numpy as np
+from main import Card, _card_rank_key, _card_suit_key, _card_rank_bit, _flush_view, \
+    _flush_suit_view, _noflush_keys as _noflush_key_view, _noflush_values as _noflush_value_view
+
+CHUNK_ROWS = 1 << 20
+
+_rank_key: np.ndarray = np.array(_card_rank_key, dtype=np.int64)
+_suit_key: np.ndarray = np.array(_card_suit_key, dtype=np.int64)
+_rank_bit: np.ndarray = np.array(_card_rank_bit, dtype=np.int64)
+_flush: np.ndarray = np.frombuffer(_flush_view, dtype=np.uint32).astype(np.int64)
+_flush_suit: np.ndarray = np.frombuffer(_flush_suit_view, dtype=np.int8).astype(np.int64)
+
+# the non-flush table is keyed by base-5 rank sums (up to ~1e9), so it's searched rather than
+# indexed; the saved keys are already sorted
+_noflush_keys: np.ndarray = np.frombuffer(_noflush_key_view, dtype=np.uint32).astype(np.int64)
+_noflush_values: np.ndarray = np.frombuffer(_noflush_value_view, dtype=np.uint32).astype(np.int64)
+
+
+def hands_to_ids(hands: list[list[Card]]) -> np.ndarray:
+    return np.array([[c.id for c in hand] for hand in hands], dtype=np.int64)
+
+
+def _evaluate_chunk(ids: np.ndarray) -> np.ndarray:
+    rank_keys: np.ndarray = _rank_key[ids].sum(axis=1)
+    suit_keys: np.ndarray = _suit_key[ids].sum(axis=1)
+    strengths: np.ndarray = _noflush_values[np.searchsorted(_noflush_keys, rank_keys)]
+
+    flush_suit: np.ndarray = _flush_suit[suit_keys]
+    flushes: np.ndarray = np.flatnonzero(flush_suit >= 0)
+    if flushes.size:
+        flush_ids: np.ndarray = ids[flushes]
+        suited: np.ndarray = (flush_ids & 3) == flush_suit[flushes, None]
+        # rank bits within one suit are distinct, so summing them is the same as or-ing them
+        masks: np.ndarray = np.where(suited, _rank_bit[flush_ids], 0).sum(axis=1)
+        strengths[flushes] = _flush[masks]
+
+    return strengths
+
+
+def evaluate_batch(ids: np.ndarray) -> np.ndarray:
+    """
+    Strengths of an (N, 5), (N, 6) or (N, 7) array of card ids, one per row.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if ids.ndim != 2 or not 5 <= ids.shape[1] <= 7:
+        raise ValueError(f"Expected an (N, 5-7) array of card ids, got shape {ids.shape}")
+
+    if ids.size and (ids.min() < 0 or ids.max() > 51):
+        raise ValueError("Card ids must be between 0 and 51")
+
+    if len(ids) <= CHUNK_ROWS:
+        return _evaluate_chunk(ids)
+
+    # bound the temporaries for very large batches
+    return np.concatenate(
+        [_evaluate_chunk(ids[i : i + CHUNK_ROWS]) for i in range(0, len(ids), CHUNK_ROWS)]
+    )
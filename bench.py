@@ -0,0 +1,327 @@
+"""
+Benchmarks for the hot paths, compared against stored JSON baselines.
+
+    python bench.py             # run and fail if a metric regressed past the threshold
+    python bench.py --update    # run and record the results as the new baseline
+
+Every metric is a time in microseconds, lower is better. Baselines are machine-specific, so none
+is checked in: record one with --update on the machine that runs the comparison, and again when
+moving to new hardware. Without a baseline nothing counts as a regression.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import logging
+import random
+import statistics
+import sys
+import time
+import timeit
+from pathlib import Path
+from typing import Any, Callable, Optional, cast
+from main import (
+    Action,
+    Deck,
+    Player,
+    Table,
+    evaluate_hand,
+    evaluate_table,
+    handle_player_action,
+)
+
+DEFAULT_BASELINE = Path(__file__).with_name("bench_baseline.json")
+DEFAULT_THRESHOLD = 0.25
+REPEAT = 7
+
+Benchmark = Callable[[], dict[str, float]]
+
+
+def _time_us(func: Callable[[], object]) -> float:
+    """
+    Best-of-REPEAT time per call, in microseconds.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(REPEAT, number)) / number * 1e6
+
+
+def _seated_table(players: int, seed: int = 0) -> Table:
+    table: Table = Table(
+        10, 20, players=[Player(f"P{i}", 10_000) for i in range(players)], deck=Deck(seed=seed)
+    )
+    table.pre_game()
+    table.flop_cards = table.deck.draw(3)
+    table.turn_card, table.river_card = table.deck.draw(2)
+
+    return table
+
+
+def bench_evaluate_hand() -> dict[str, float]:
+    rng = random.Random(0)
+    hands = [rng.sample(Deck().cards, 5) for _ in range(256)]
+    hand_iter = itertools.cycle(hands)
+
+    return {"evaluate_hand": _time_us(lambda: evaluate_hand(next(hand_iter)))}
+
+
+def bench_evaluate_table() -> dict[str, float]:
+    return {
+        f"evaluate_table[{n}]": _time_us(lambda t=_seated_table(n): evaluate_table(t))
+        for n in range(2, 10)
+    }
+
+
+def bench_deck() -> dict[str, float]:
+    deck: Deck = Deck(seed=0)
+
+    def draw_hand():
+        deck.reset()
+        deck.draw(2 * 6 + 5)
+
+    return {"deck_create": _time_us(Deck), "deck_draw_6_handed": _time_us(draw_hand)}
+
+
+def bench_handle_player_action() -> dict[str, float]:
+    table: Table = _seated_table(6)
+    table.current_bet = 40
+
+    def act():
+        mark: int = table.checkpoint()
+        handle_player_action(table, 0, Action(3, 100))
+        handle_player_action(table, 1, Action(2))
+        table.rollback(mark)
+
+    return {"handle_player_action": _time_us(act) / 2}
+
+
+def bench_begin_game() -> dict[str, float]:
+    def play():
+        players = [Player(f"P{i}", 10_000) for i in range(6)]
+        rounds = [
+            [Action(3, 100)] + [Action(2)] * 5,
+            [Action(1)] * 6,
+            [Action(3, 200)] + [Action(4)] * 4 + [Action(2)],
+            [Action(1)] * 2,
+        ]
+        Table(10, 20, players=players, player_actions=rounds, deck=Deck(seed=1)).begin_game()
+
+    return {"begin_game_6_handed": _time_us(play)}
+
+
+async def _server_round_trips(messages: int) -> list[float]:
+    import websockets
+    import server
+
+    async def join(uri: str, name: str, choice: Optional[str]) -> websockets.ClientConnection:
+        ws = await websockets.connect(uri)
+        await ws.recv()  # name prompt
+        await ws.send(name)
+        if choice is not None:
+            await ws.recv()  # create or join prompt
+            await ws.send(choice)
+            await ws.recv()  # room list
+            await ws.send("1")
+            await ws.recv()  # table snapshot
+        else:
+            await ws.recv()  # host confirmation
+        return ws
+
+    async with websockets.serve(server.handler, "localhost", 0) as srv:
+        port: int = srv.sockets[0].getsockname()[1]
+        uri: str = f"ws://localhost:{port}"
+        sender = await join(uri, "sender", None)
+        receiver = await join(uri, "receiver", "2")
+        await sender.recv()  # join notice
+
+        latencies: list[float] = []
+        for i in range(messages):
+            start: float = time.perf_counter()
+            await sender.send(f"ping {i}")
+            await receiver.recv()
+            latencies.append((time.perf_counter() - start) * 1e6)
+
+        await sender.close()
+        await receiver.close()
+
+    server.registry.clear()
+    return latencies
+
+
+def bench_server_round_trip() -> dict[str, float]:
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        print("websockets is not installed, skipping server benchmarks", file=sys.stderr)
+        return {}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        latencies: list[float] = asyncio.run(_server_round_trips(2000))
+
+    return {
+        "server_round_trip_p50": statistics.median(latencies),
+        "server_round_trip_p99": statistics.quantiles(latencies, n=100)[98],
+    }
+
+
+def bench_protocol() -> dict[str, float]:
+    from protocol import BINARY, BOARD, TEXT, Message, MsgType
+
+    turn: Message = Message(MsgType.TURN, (2, 40, 150), text="P2")
+    board: Message = Message(MsgType.CARDS, (BOARD,), cards=(0, 17, 33, 42, 51))
+    results: dict[str, float] = {}
+    for name, codec in (("text", TEXT), ("binary", BINARY)):
+        reply = codec.encode(Message(MsgType.ACTION, (3, 200)))
+        results[f"protocol_encode_turn[{name}]"] = _time_us(lambda: codec.encode(turn))
+        results[f"protocol_encode_board[{name}]"] = _time_us(lambda: codec.encode(board))
+        results[f"protocol_decode_action[{name}]"] = _time_us(lambda: codec.decode(reply))
+
+    return results
+
+
+def bench_range_equity() -> dict[str, float]:
+    from main import card_from_id
+    from ranges import parse_range, range_equity
+
+    board = [card_from_id(i) for i in (0, 17, 42)]
+    opener = parse_range("22+, A2s+, K9s+, Q9s+, J9s+, T9s, 98s, 87s, 76s, ATo+, KJo+, QJo")
+    caller = parse_range("22+, A2+, K2s+, K8o+, Q5s+, Q9o+, J7s+, J9o+, T7s+, 96s+, 86s+, 75s+, 65s")
+    everything = parse_range("random")
+
+    return {
+        "range_equity_flop": _time_us(lambda: range_equity([opener, caller], board)),
+        "range_equity_flop_full": _time_us(lambda: range_equity([everything, everything], board)),
+    }
+
+
+async def _broadcast_latencies(room_size: int, messages: int) -> list[float]:
+    from broadcast import DROP, Broadcaster
+
+    class Client:
+        def __init__(self, stalled: bool):
+            self.stalled: bool = stalled
+            self.received: asyncio.Event = asyncio.Event()
+            self.remote_address = None
+
+        async def send(self, message: str):
+            if self.stalled:
+                await asyncio.Future()  # never drains its socket
+            self.received.set()
+
+    broadcaster: Broadcaster = Broadcaster(maxsize=16, policy=DROP)
+    stalled: Client = Client(True)
+    clients: list[Client] = [Client(False) for _ in range(room_size - 1)]
+    # the fakes stand in for ServerConnection
+    for client in [stalled, *clients]:
+        broadcaster.attach(cast(Any, client))
+
+    latencies: list[float] = []
+    for i in range(messages):
+        for client in clients:
+            client.received.clear()
+        start: float = time.perf_counter()
+        broadcaster.broadcast(broadcaster.outboxes, f"chat {i}")
+        for client in clients:
+            await client.received.wait()
+        latencies.append((time.perf_counter() - start) * 1e6)
+
+    for client in [stalled, *clients]:
+        broadcaster.detach(cast(Any, client))
+    return latencies
+
+
+def bench_broadcast() -> dict[str, float]:
+    """
+    Time until every member of the room has a chat message, with one member that never reads.
+    """
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        print("websockets is not installed, skipping broadcast benchmarks", file=sys.stderr)
+        return {}
+
+    results: dict[str, float] = {}
+    for room_size in (2, 9, 50):
+        latencies: list[float] = asyncio.run(_broadcast_latencies(room_size, 2000))
+        results[f"broadcast_p99[{room_size}]"] = statistics.quantiles(latencies, n=100)[98]
+
+    return results
+
+
+BENCHMARKS: list[Benchmark] = [
+    bench_evaluate_hand,
+    bench_evaluate_table,
+    bench_deck,
+    bench_handle_player_action,
+    bench_begin_game,
+    bench_server_round_trip,
+    bench_broadcast,
+    bench_protocol,
+    bench_range_equity,
+]
+
+
+def run(only: Optional[str] = None) -> dict[str, float]:
+    previous: int = logging.root.manager.disable
+    logging.disable(logging.CRITICAL)
+    try:
+        results: dict[str, float] = {}
+        for bench in BENCHMARKS:
+            if only is None or only in bench.__name__:
+                results.update(bench())
+        return results
+    finally:
+        logging.disable(previous)
+
+
+def regressions(
+    results: dict[str, float], baseline: dict[str, float], threshold: float
+) -> dict[str, tuple[float, float]]:
+    """
+    Metrics slower than baseline * (1 + threshold), as (baseline, current). Metrics missing from
+    either side are ignored.
+    """
+    return {
+        name: (baseline[name], value)
+        for name, value in results.items()
+        if name in baseline and value > baseline[name] * (1 + threshold)
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--update", action="store_true", help="record results as the baseline")
+    parser.add_argument("--only", help="only run benchmarks whose name contains this")
+    args = parser.parse_args(argv)
+
+    results: dict[str, float] = run(args.only)
+    baseline: dict[str, float] = (
+        json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    )
+
+    for name, value in results.items():
+        change: str = ""
+        if name in baseline:
+            change = f"{(value / baseline[name] - 1) * 100:+7.1f}%"
+        print(f"{name:<28} {value:12.2f} us {change}")
+
+    if args.update:
+        args.baseline.write_text(json.dumps({**baseline, **results}, indent=2, sort_keys=True) + "\n")
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    failed = regressions(results, baseline, args.threshold)
+    for name, (before, after) in failed.items():
+        print(f"REGRESSION {name}: {before:.2f} us -> {after:.2f} us", file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
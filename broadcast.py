@@ -0,0 +1,152 @@
+"""
+Outbound fan-out for the server. Every connection gets an Outbox: a bounded queue drained by its
+own writer task, so sending to a room never waits on any one client's socket.
+"""
+
+from __future__ import annotations
+import asyncio
+import logging
+from typing import Iterable, Optional
+import websockets
+
+DROP = "drop"
+DISCONNECT = "disconnect"
+DEFAULT_QUEUE_SIZE = 256
+# how long a connection that's being closed gets to write out what's still queued for it
+DRAIN_TIMEOUT = 1.0
+
+# close code sent to clients that fall too far behind ("try again later")
+SLOW_CLIENT_CLOSE_CODE = 1013
+
+log: logging.Logger = logging.getLogger("poker.broadcast")
+
+
+class Outbox:
+    """
+    Queues messages for one connection. When the queue is full the policy decides: DROP discards
+    the oldest queued message to make room, DISCONNECT closes the connection.
+    """
+
+    def __init__(
+        self,
+        ws: websockets.ServerConnection,
+        maxsize: int = DEFAULT_QUEUE_SIZE,
+        policy: str = DISCONNECT,
+    ):
+        if policy not in (DROP, DISCONNECT):
+            raise ValueError(f"unknown overflow policy {policy!r}")
+
+        self.ws: websockets.ServerConnection = ws
+        self.policy: str = policy
+        self.dropped: int = 0
+        self.closed: bool = False
+        self._queue: asyncio.Queue[str | bytes] = asyncio.Queue(maxsize)
+        self._writer: asyncio.Task = asyncio.create_task(self._write())
+        self._closing: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    def send(self, message: str | bytes) -> bool:
+        """
+        Queues a message without waiting. Returns False if the connection is closed or was just
+        closed for being too slow.
+        """
+        if self.closed:
+            return False
+
+        if self._queue.full():
+            if self.policy == DISCONNECT:
+                log.warning("Closing %s: send queue full", self.ws.remote_address)
+                self.close()
+                self._closing = asyncio.create_task(
+                    self.ws.close(SLOW_CLIENT_CLOSE_CODE, "send queue full")
+                )
+                return False
+
+            self._queue.get_nowait()
+            self._queue.task_done()
+            self.dropped += 1
+
+        self._queue.put_nowait(message)
+        return True
+
+    def close(self):
+        """
+        Stops writing at once, discarding anything still queued. drain() first to deliver it.
+        """
+        self.closed = True
+        self._writer.cancel()
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT):
+        """
+        Waits until everything queued so far is written, the connection closes or timeout passes.
+        """
+        if self.closed or self._writer.done():
+            return
+
+        flushed: asyncio.Task = asyncio.create_task(self._queue.join())
+        try:
+            await asyncio.wait(
+                [flushed, self._writer], timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            flushed.cancel()
+
+    async def _write(self):
+        try:
+            while True:
+                message: str | bytes = await self._queue.get()
+                await self.ws.send(message)
+                self._queue.task_done()
+        except websockets.ConnectionClosed:
+            self.closed = True
+
+
+class Broadcaster:
+    """
+    Owns the outboxes of every live connection.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_QUEUE_SIZE, policy: str = DISCONNECT):
+        self.maxsize: int = maxsize
+        self.policy: str = policy
+        self.outboxes: dict[websockets.ServerConnection, Outbox] = {}
+
+    def attach(self, ws: websockets.ServerConnection) -> Outbox:
+        outbox: Outbox = Outbox(ws, self.maxsize, self.policy)
+        self.outboxes[ws] = outbox
+
+        return outbox
+
+    def detach(self, ws: websockets.ServerConnection):
+        outbox: Optional[Outbox] = self.outboxes.pop(ws, None)
+        if outbox is not None:
+            outbox.close()
+
+    async def drain_and_detach(
+        self, ws: websockets.ServerConnection, timeout: float = DRAIN_TIMEOUT
+    ):
+        """
+        detach(), after giving the connection up to timeout to write out its queue, e.g. a final
+        error sent just before the handler returns.
+        """
+        outbox: Optional[Outbox] = self.outboxes.get(ws)
+        if outbox is not None:
+            await outbox.drain(timeout)
+        self.detach(ws)
+
+    def send(self, ws: websockets.ServerConnection, message: str | bytes) -> bool:
+        outbox: Optional[Outbox] = self.outboxes.get(ws)
+        return outbox is not None and outbox.send(message)
+
+    def broadcast(
+        self,
+        conns: Iterable[websockets.ServerConnection],
+        message: str | bytes,
+        exclude: Optional[websockets.ServerConnection] = None,
+    ) -> int:
+        """
+        Queues the message for every connection except `exclude`. Returns how many accepted it.
+        """
+        return sum(self.send(ws, message) for ws in conns if ws is not exclude)
@@ -0,0 +1,224 @@
+"""
+Multi-process deployment of the server. Worker processes each run server.handler on a Unix socket
+and own the rooms whose id maps to them (room id % workers). A front router accepts every client
+connection, runs the lobby itself against one room directory (so every client sees the same room
+list whichever worker hosts a room), then opens a connection to the owning worker and relays
+frames both ways untouched. Everything after the lobby, the game included, runs in the worker.
+
+A connection can't be routed at accept time because the room is chosen after the websocket
+handshake, which is why there's a router rather than SO_REUSEPORT: the kernel would spread
+connections across workers before anyone knows which room they want.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import multiprocessing.process
+import multiprocessing.synchronize
+import os
+import shutil
+import signal
+import tempfile
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlencode
+import websockets
+import equity
+import eventlog
+import metrics
+import server
+from history import HistoryWriter
+from main import Player
+from protocol import Message, MsgType, codec_for
+from registry import Room
+from shmcache import SharedCache
+
+DEFAULT_PORT = 8765
+# how long a worker gets to start listening, and a joiner waits for its room to open on one
+START_TIMEOUT = 30.0
+ROUTE_TIMEOUT = 5.0
+
+log: logging.Logger = logging.getLogger("poker.cluster")
+
+
+def _run_worker(
+    shard: int, path: str, ready: multiprocessing.synchronize.Event, cache_name: Optional[str]
+):
+    server.routed = True
+    eventlog.configure_from_env()
+    if cache_name is not None:
+        equity.use_shared_cache(SharedCache.attach(cache_name))
+    asyncio.run(_serve_worker(shard, path, ready))
+
+
+async def _serve_worker(shard: int, path: str, ready: multiprocessing.synchronize.Event):
+    if "POKER_HISTORY_DIR" in os.environ:
+        server.history = HistoryWriter(os.environ["POKER_HISTORY_DIR"], f"server{shard}")
+    if "POKER_METRICS_PORT" in os.environ:
+        # the router takes the port itself, workers the ones after it
+        await metrics.serve(port=int(os.environ["POKER_METRICS_PORT"]) + 1 + shard)
+
+    stop: asyncio.Future = asyncio.get_running_loop().create_future()
+    # terminate() sends SIGTERM: finish cleanly so buffered hands reach the history
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set_result, None)
+    try:
+        async with websockets.unix_serve(
+            server.handler, path, select_subprotocol=server.select_subprotocol
+        ):
+            ready.set()
+            await stop
+    finally:
+        if server.history is not None:
+            server.history.close()
+
+
+class Router:
+    """
+    Starts the workers and routes connections to them. Use as a context manager, or call start()
+    and stop(); handler() is the websocket handler for the public port.
+    """
+
+    def __init__(self, workers: Optional[int] = None, socket_dir: Optional[Path] = None):
+        self.workers: int = workers or os.cpu_count() or 1
+        self._own_dir: bool = socket_dir is None
+        self.socket_dir: Path = Path(socket_dir or tempfile.mkdtemp(prefix="poker-"))
+        self.processes: list[multiprocessing.process.BaseProcess] = []
+        # exact equity results computed by any worker are reused by all of them
+        self.cache: Optional[SharedCache] = None
+        # set once a room's creator is connected to its worker, so joiners don't race ahead
+        self._opened: dict[int, asyncio.Event] = {}
+
+    def __enter__(self) -> Router:
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def socket_path(self, shard: int) -> Path:
+        return self.socket_dir / f"worker-{shard}.sock"
+
+    def shard_of(self, room_id: int) -> int:
+        return room_id % self.workers
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        self.cache = SharedCache.create()
+        events: list[multiprocessing.synchronize.Event] = []
+        for shard in range(self.workers):
+            ready = context.Event()
+            process = context.Process(
+                target=_run_worker,
+                args=(shard, str(self.socket_path(shard)), ready, self.cache.name),
+                name=f"poker-worker-{shard}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+            events.append(ready)
+
+        for shard, ready in enumerate(events):
+            if not ready.wait(START_TIMEOUT):
+                self.stop()
+                raise RuntimeError(f"worker {shard} didn't start")
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        self.processes.clear()
+        if self.cache is not None:
+            self.cache.close()
+            self.cache.unlink()
+            self.cache = None
+        if self._own_dir:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+    async def handler(self, ws: websockets.ServerConnection):
+        server.broadcaster.attach(ws)
+        server.codecs[ws] = codec_for(ws.subprotocol)
+        metrics.count("connections")
+        try:
+            server.send(ws, Message(MsgType.ASK_NAME))
+            name: str = (await server.receive(ws, MsgType.HELLO)).text
+            player: Player = Player(name, 1000)
+            room, how = await server.choose_room(ws, player)
+            try:
+                await self._relay(ws, player, room, how)
+            finally:
+                left: Optional[Room] = server.registry.leave(ws)
+                if left is not None and left.id not in server.registry:
+                    self._opened.pop(left.id, None)
+        finally:
+            del server.codecs[ws]
+            # whatever was queued last, e.g. an error, still reaches the client
+            await server.broadcaster.drain_and_detach(ws)
+
+    async def _relay(self, ws: websockets.ServerConnection, player: Player, room: Room, how: int):
+        opened: asyncio.Event = self._opened.setdefault(room.id, asyncio.Event())
+        if how != server.CREATE:
+            try:
+                await asyncio.wait_for(opened.wait(), ROUTE_TIMEOUT)
+            except asyncio.TimeoutError:
+                server.send(ws, Message(MsgType.ERROR, text="The room is unavailable."))
+                return
+
+        uri: str = f"ws://localhost/{how}/{room.id}?{urlencode({'name': player.name})}"
+        path: Path = self.socket_path(self.shard_of(room.id))
+        try:
+            upstream = await websockets.unix_connect(
+                str(path), uri, subprotocols=[ws.subprotocol] if ws.subprotocol else None
+            )
+        except (OSError, websockets.InvalidHandshake):
+            log.exception("Can't reach the worker for room %d", room.id)
+            server.send(ws, Message(MsgType.ERROR, text="The room is unavailable."))
+            return
+
+        async with upstream:
+            forward: asyncio.Task = asyncio.create_task(self._forward(upstream, ws, opened))
+            try:
+                async for data in ws:
+                    await upstream.send(data)
+            except websockets.ConnectionClosed:
+                pass
+            finally:
+                forward.cancel()
+
+    async def _forward(
+        self,
+        upstream: websockets.ClientConnection,
+        ws: websockets.ServerConnection,
+        opened: asyncio.Event,
+    ):
+        try:
+            async for data in upstream:
+                # the worker's first frame means it has the room, creator included
+                opened.set()
+                server.broadcaster.send(ws, data)
+        except websockets.ConnectionClosed:
+            pass
+        await ws.close()
+
+
+async def serve(router: Router, host: str = "localhost", port: int = DEFAULT_PORT):
+    if "POKER_METRICS_PORT" in os.environ:
+        await metrics.serve(port=int(os.environ["POKER_METRICS_PORT"]))
+    async with websockets.serve(
+        router.handler, host, port, select_subprotocol=server.select_subprotocol
+    ):
+        await asyncio.Future()  # run forever
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the server across worker processes")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    eventlog.configure_from_env()
+    with Router(args.workers) as router:
+        asyncio.run(serve(router, args.host, args.port))
@@ -0,0 +1,167 @@
+"""
+Public table state for clients and spectators, streamed as numbered deltas. The state is a flat
+map of (Field, seat) -> value; hole cards and the deck are never part of it. A TableStream watches
+every change the table makes through Table.update() and coalesces them until the next flush(), so
+a delta carries only what changed since the previous one.
+"""
+
+from __future__ import annotations
+from collections import deque
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Optional, Union
+from main import Player, Table, community_cards
+
+
+class Field(IntEnum):
+    # table-wide, always seat 0
+    POT = 1
+    BET = 2
+    BOARD = 3
+    DEALER = 4
+    SEATS = 5
+    # per seat
+    NAME = 6
+    CHIPS = 7
+    ACTIVE = 8
+
+
+Key = tuple[Field, int]
+# an int, a bool (ACTIVE), a str (NAME) or a tuple of card ids (BOARD)
+Value = Union[int, bool, str, tuple[int, ...]]
+Change = tuple[Field, int, Value]
+
+DEFAULT_HISTORY = 256
+
+
+@dataclass(frozen=True)
+class Delta:
+    """
+    Changes that take a client from seq - 1 to seq. A snapshot is a Delta holding every key.
+    """
+
+    seq: int
+    changes: tuple[Change, ...]
+
+
+def _seat_state(table: Table) -> dict[Key, Value]:
+    state: dict[Key, Value] = {(Field.SEATS, 0): len(table.players)}
+    for seat, player in enumerate(table.players):
+        state[(Field.NAME, seat)] = player.name
+        state[(Field.CHIPS, seat)] = player.chips
+        state[(Field.ACTIVE, seat)] = player.is_active
+
+    return state
+
+
+def table_state(table: Table) -> dict[Key, Value]:
+    state: dict[Key, Value] = {
+        (Field.POT, 0): table.pot_size,
+        (Field.BET, 0): table.current_bet,
+        (Field.BOARD, 0): tuple(card.id for card in community_cards(table)),
+        (Field.DEALER, 0): table.dealer,
+    }
+    state.update(_seat_state(table))
+
+    return state
+
+
+def apply(state: dict[Key, Value], delta: Delta) -> dict[Key, Value]:
+    """
+    Client side: applies a delta (or snapshot) to a state map in place and returns it.
+    """
+    for field, seat, value in delta.changes:
+        state[(field, seat)] = value
+        if field == Field.SEATS and isinstance(value, int):
+            # seats past the end belong to players who left the table
+            for key in [key for key in state if key[0] >= Field.NAME and key[1] >= value]:
+                del state[key]
+
+    return state
+
+
+class TableStream:
+    """
+    Numbers the table's public state changes. Keeps the last `history` deltas so a client that
+    reconnects with the last seq it saw can catch up without a full snapshot.
+    """
+
+    def __init__(self, table: Table, history: int = DEFAULT_HISTORY):
+        self.table: Table = table
+        self.seq: int = 0
+        self._published: dict[Key, Value] = table_state(table)
+        self._pending: dict[Key, Value] = {}
+        self._log: deque[Delta] = deque(maxlen=history)
+        table.observers.append(self._observe)
+
+    def _observe(self, obj: object, attr: str, value: object):
+        pending: dict[Key, Value] = self._pending
+        table: Table = self.table
+        if obj is table:
+            match attr:
+                # observers run after the change, so the attributes already hold value
+                case "pot_size":
+                    pending[(Field.POT, 0)] = table.pot_size
+                case "current_bet":
+                    pending[(Field.BET, 0)] = table.current_bet
+                case "flop_cards" | "turn_card" | "river_card":
+                    pending[(Field.BOARD, 0)] = tuple(card.id for card in community_cards(table))
+                case "dealer":
+                    pending[(Field.DEALER, 0)] = table.dealer
+                case "players":
+                    pending.update(_seat_state(table))
+        elif isinstance(obj, Player) and attr in ("chips", "is_active"):
+            try:
+                seat: int = table.players.index(obj)
+            except ValueError:
+                return
+            if attr == "chips":
+                pending[(Field.CHIPS, seat)] = obj.chips
+            else:
+                pending[(Field.ACTIVE, seat)] = obj.is_active
+
+    def flush(self) -> Optional[Delta]:
+        """
+        Publishes the changes since the last flush as the next delta. Returns None when nothing
+        visible changed, e.g. a value that was changed and then rolled back.
+        """
+        published: dict[Key, Value] = self._published
+        changes: tuple[Change, ...] = tuple(
+            (field, seat, value)
+            for (field, seat), value in self._pending.items()
+            if (field, seat) not in published or published[(field, seat)] != value
+        )
+        self._pending.clear()
+        if not changes:
+            return None
+
+        self.seq += 1
+        delta: Delta = Delta(self.seq, changes)
+        apply(published, delta)
+        self._log.append(delta)
+
+        return delta
+
+    def snapshot(self) -> Delta:
+        """
+        Every key of the last published state, stamped with the current seq.
+        """
+        changes: tuple[Change, ...] = tuple(
+            (field, seat, value) for (field, seat), value in self._published.items()
+        )
+        return Delta(self.seq, changes)
+
+    def since(self, seq: int) -> Optional[list[Delta]]:
+        """
+        The deltas after seq, or None if they have already left the history (or seq is from the
+        future) and the client needs a snapshot instead.
+        """
+        if seq == self.seq:
+            return []
+        if seq > self.seq or not self._log or seq < self._log[0].seq - 1:
+            return None
+
+        return [delta for delta in self._log if delta.seq > seq]
+
+    def close(self):
+        self.table.observers.remove(self._observe)
@@ -0,0 +1,498 @@
+"""
+All-in equity. monte_carlo_equity samples board runouts, spread over a process pool, until the
+estimate converges or a time budget runs out. exact_equity enumerates every runout.
+"""
+
+from __future__ import annotations
+import os
+import struct
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import combinations, permutations
+from math import comb, sqrt
+from typing import Optional
+from main import (
+    Card,
+    Deck,
+    Player,
+    Table,
+    community_cards,
+    evaluate_ids,
+    rng_stream,
+    _card_rank_key,
+    _card_suit_key,
+    _flush_suit_table,
+    _flush_table,
+    _noflush_table,
+)
+from shmcache import SharedCache
+
+BATCH_SAMPLES = 2000
+# batch size under a time budget, small enough that waiting on one barely overshoots it
+BUDGET_BATCH_SAMPLES = 250
+MAX_SAMPLES = 500_000
+
+
+@dataclass(frozen=True)
+class PlayerEquity:
+    win: float
+    tie: float
+    equity: float
+
+
+# frozen, as exact results are cached and handed to every caller of the same spot
+@dataclass(frozen=True)
+class EquityResult:
+    players: tuple[PlayerEquity, ...]
+    samples: int
+    stderr: float
+
+
+@dataclass
+class _Tally:
+    """
+    Running totals for one or more batches. shares[i] sums player i's pot share per runout and
+    shares_sq its square, for the standard error.
+    """
+
+    samples: int
+    wins: list[int]
+    ties: list[int]
+    shares: list[float]
+    shares_sq: list[float]
+
+    @classmethod
+    def empty(cls, players: int) -> _Tally:
+        return cls(0, [0] * players, [0] * players, [0.0] * players, [0.0] * players)
+
+    def merge(self, other: _Tally):
+        self.samples += other.samples
+        for i in range(len(self.wins)):
+            self.wins[i] += other.wins[i]
+            self.ties[i] += other.ties[i]
+            self.shares[i] += other.shares[i]
+            self.shares_sq[i] += other.shares_sq[i]
+
+    def stderr(self) -> float:
+        if self.samples < 2:
+            return float("inf")
+
+        n: int = self.samples
+        return max(
+            sqrt(max(sq / n - (s / n) ** 2, 0.0) / (n - 1))
+            for s, sq in zip(self.shares, self.shares_sq)
+        )
+
+    def result(self) -> EquityResult:
+        n: int = max(self.samples, 1)
+        return EquityResult(
+            tuple(
+                PlayerEquity(w / n, t / n, s / n)
+                for w, t, s in zip(self.wins, self.ties, self.shares)
+            ),
+            self.samples,
+            self.stderr(),
+        )
+
+
+def _validate(
+    hands: list[list[Card]], board: list[Card], dead: list[Card]
+) -> list[Card]:
+    if not 2 <= len(hands) <= 9:
+        raise ValueError("Equity needs between 2 and 9 players")
+    if any(len(hand) != 2 for hand in hands):
+        raise ValueError("Every player needs exactly two hole cards")
+    if len(board) not in (0, 3, 4, 5):
+        raise ValueError("Board must be empty, a flop, a turn or a river")
+
+    known: list[Card] = [c for hand in hands for c in hand] + board + dead
+    if len(set(known)) != len(known):
+        raise ValueError("The same card appears more than once")
+
+    return known
+
+
+def _sample_batch(
+    hand_ids: list[list[int]],
+    board_ids: list[int],
+    known_ids: list[int],
+    count: int,
+    seed: Optional[int],
+    stream: int,
+) -> _Tally:
+    """
+    Deals count runouts from a deck seeded for this batch and tallies who wins each one.
+    """
+    deck: Deck = Deck(rng=rng_stream(seed, stream))
+    deck.remove_ids(known_ids)
+    base: int = deck.top
+    missing: int = 5 - len(board_ids)
+
+    # hole cards + board never change, so their keys are summed once per player
+    base_rank: list[int] = [sum(_card_rank_key[i] for i in h + board_ids) for h in hand_ids]
+    base_suit: list[int] = [sum(_card_suit_key[i] for i in h + board_ids) for h in hand_ids]
+    players: range = range(len(hand_ids))
+    tally: _Tally = _Tally.empty(len(hand_ids))
+    wins, ties, shares, shares_sq = tally.wins, tally.ties, tally.shares, tally.shares_sq
+    strengths: list[int] = [0] * len(hand_ids)
+
+    for _ in range(count):
+        deck.top = base
+        runout: list[int] = deck.draw_ids(missing)
+        rank_key: int = 0
+        suit_key: int = 0
+        for i in runout:
+            rank_key += _card_rank_key[i]
+            suit_key += _card_suit_key[i]
+
+        for p in players:
+            if _flush_suit_table[base_suit[p] + suit_key] < 0:
+                strengths[p] = _noflush_table[base_rank[p] + rank_key]
+            else:
+                strengths[p] = evaluate_ids(hand_ids[p] + board_ids + runout)
+
+        best: int = max(strengths)
+        winners: list[int] = [p for p in players if strengths[p] == best]
+        if len(winners) == 1:
+            wins[winners[0]] += 1
+            shares[winners[0]] += 1.0
+            shares_sq[winners[0]] += 1.0
+        else:
+            share: float = 1.0 / len(winners)
+            for p in winners:
+                ties[p] += 1
+                shares[p] += share
+                shares_sq[p] += share * share
+
+    tally.samples = count
+    return tally
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+
+    return _executor
+
+
+def shutdown_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def monte_carlo_equity(
+    hands: list[list[Card]],
+    board: Optional[list[Card]] = None,
+    dead: Optional[list[Card]] = None,
+    *,
+    target_stderr: Optional[float] = 0.005,
+    time_budget: Optional[float] = None,
+    max_samples: int = MAX_SAMPLES,
+    batch_samples: int = BATCH_SAMPLES,
+    seed: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    parallel: bool = True,
+) -> EquityResult:
+    """
+    Estimates each player's win, tie and equity share by sampling runouts.
+
+    Batches of batch_samples runouts are farmed out to a shared process pool (or the given
+    executor), each with its own RNG stream derived from seed. Sampling stops once the largest
+    per-player standard error falls to target_stderr, time_budget seconds have passed, or
+    max_samples runouts have been dealt. Batches are merged in submission order, so a fixed seed
+    reproduces the same result. parallel=False samples in this process, which is cheaper for
+    small requests.
+
+    With a time_budget, batches shrink to BUDGET_BATCH_SAMPLES and the result always holds at
+    least one: if the pool hasn't delivered any by the deadline (e.g. it is still starting), the
+    first batch is dealt in this process instead.
+    """
+    board = board or []
+    dead = dead or []
+    known: list[Card] = _validate(hands, board, dead)
+    args = (
+        [[c.id for c in hand] for hand in hands],
+        [c.id for c in board],
+        [c.id for c in known],
+    )
+    deadline: Optional[float] = (
+        time.perf_counter() + time_budget if time_budget is not None else None
+    )
+    tally: _Tally = _Tally.empty(len(hands))
+    if deadline is not None:
+        batch_samples = min(batch_samples, BUDGET_BATCH_SAMPLES)
+
+    def done() -> bool:
+        if tally.samples == 0:
+            return False
+        if tally.samples >= max_samples:
+            return True
+        if target_stderr is not None and tally.stderr() <= target_stderr:
+            return True
+        return deadline is not None and time.perf_counter() >= deadline
+
+    if len(board) == 5:
+        # nothing left to deal
+        return _sample_batch(*args, 1, seed, 0).result()
+
+    if not parallel:
+        stream: int = 0
+        while not done():
+            count: int = min(batch_samples, max_samples - tally.samples)
+            tally.merge(_sample_batch(*args, count, seed, stream))
+            stream += 1
+
+        return tally.result()
+
+    pool: Executor = executor or _pool()
+    in_flight: int = 2 * (os.cpu_count() or 1)
+    pending: deque[Future[_Tally]] = deque()
+    submitted: int = 0
+    stream = 0
+
+    def submit():
+        nonlocal submitted, stream
+        count: int = min(batch_samples, max_samples - submitted)
+        if count > 0:
+            pending.append(pool.submit(_sample_batch, *args, count, seed, stream))
+            submitted += count
+            stream += 1
+
+    for _ in range(in_flight):
+        submit()
+
+    while pending and not done():
+        if deadline is not None:
+            wait([pending[0]], timeout=max(0.0, deadline - time.perf_counter()))
+            if not pending[0].done():
+                if tally.samples:
+                    break
+                # nothing back from the pool in time: the same first batch, dealt here
+                pending.popleft().cancel()
+                tally.merge(_sample_batch(*args, min(batch_samples, max_samples), seed, 0))
+                continue
+        tally.merge(pending.popleft().result())
+        submit()
+
+    for future in pending:
+        future.cancel()
+
+    return tally.result()
+
+
+def table_equity(table: Table, **kwargs) -> dict[Player, PlayerEquity]:
+    """
+    Equity of every active player at the table against the current board, keyed by player: names
+    needn't be unique.
+    """
+    players = [p for p in table.players if p.is_active]
+    result: EquityResult = monte_carlo_equity(
+        [p.hand for p in players], community_cards(table), **kwargs
+    )
+
+    return dict(zip(players, result.players))
+
+
+# --- Exact enumeration ---
+#
+# Only one suit can ever make a flush on a given runout: two players flushing in different suits
+# would need at least five of their hole cards between them. So the runouts split by the suit of
+# the flush, if any. For each suit, a runout where somebody flushes is the set of its cards in that
+# suit plus the cards of the other three suits, and everything but the flushing players' strength
+# depends only on the ranks of those other cards. Those are enumerated as rank multisets, each
+# weighted by the number of card sets it stands for.
+#
+# Every other runout only depends on its ranks: all runouts are counted by rank multiset, the
+# flushing ones are taken back out, and each remaining multiset is scored once.
+
+
+def _rank_multisets(available: list[int], size: int) -> list[tuple[int, int]]:
+    """
+    Every multiset of size ranks with at most available[r] cards of rank r, as (rank key, number
+    of card sets with those ranks).
+    """
+    partial: list[tuple[int, int, int]] = [(0, 1, 0)]
+    for rank, count in enumerate(available):
+        key: int = _card_rank_key[rank * 4]
+        partial = [
+            (rank_key + m * key, ways * comb(count, m), n + m)
+            for rank_key, ways, n in partial
+            for m in range(min(count, size - n) + 1)
+        ]
+
+    return [(rank_key, ways) for rank_key, ways, n in partial if n == size]
+
+
+def _enumerate(
+    hand_ids: tuple[tuple[int, ...], ...], board_ids: tuple[int, ...], dead_ids: tuple[int, ...]
+) -> EquityResult:
+    known: set[int] = {i for h in hand_ids for i in h} | set(board_ids) | set(dead_ids)
+    players: range = range(len(hand_ids))
+    base_rank: list[int] = [sum(_card_rank_key[i] for i in h + board_ids) for h in hand_ids]
+    missing: int = 5 - len(board_ids)
+
+    wins: list[int] = [0] * len(hand_ids)
+    ties: list[int] = [0] * len(hand_ids)
+    shares: list[float] = [0.0] * len(hand_ids)
+
+    def tally(strengths: list[int], weight: int):
+        best: int = max(strengths)
+        winners: list[int] = [p for p in players if strengths[p] == best]
+        if len(winners) == 1:
+            wins[winners[0]] += weight
+            shares[winners[0]] += weight
+        else:
+            for p in winners:
+                ties[p] += weight
+                shares[p] += weight / len(winners)
+
+    unseen: list[list[int]] = [[s for s in range(4) if r * 4 + s not in known] for r in range(13)]
+    rank_only: dict[int, int] = dict(_rank_multisets([len(u) for u in unseen], missing))
+
+    for suit in range(4):
+        # ranks each player already holds in this suit, counting the board
+        cards: list[list[int]] = [
+            [i >> 2 for i in h + board_ids if i & 3 == suit] for h in hand_ids
+        ]
+        masks: list[int] = [sum(1 << r for r in held) for held in cards]
+        ranks: list[int] = [r for r in range(13) if suit in unseen[r]]
+        others: list[int] = [len(u) - (suit in u) for u in unseen]
+        for k in range(max(5 - max(len(c) for c in cards), 0), min(missing, len(ranks)) + 1):
+            flushing: list[bool] = [len(c) + k >= 5 for c in cards]
+            rest: list[tuple[int, int]] = _rank_multisets(others, missing - k)
+            for suited in combinations(ranks, k):
+                suited_key: int = sum(_card_rank_key[r * 4] for r in suited)
+                suited_mask: int = sum(1 << r for r in suited)
+                flushes: list[int] = [_flush_table[m | suited_mask] for m in masks]
+                for rest_key, ways in rest:
+                    rank_key: int = suited_key + rest_key
+                    rank_only[rank_key] -= ways
+                    tally(
+                        [
+                            flushes[p] if flushing[p] else _noflush_table[base_rank[p] + rank_key]
+                            for p in players
+                        ],
+                        ways,
+                    )
+
+    for rank_key, weight in rank_only.items():
+        if weight:
+            tally([_noflush_table[base_rank[p] + rank_key] for p in players], weight)
+
+    total: int = comb(52 - len(known), missing)
+    return EquityResult(
+        tuple(PlayerEquity(w / total, t / total, s / total) for w, t, s in zip(wins, ties, shares)),
+        total,
+        0.0,
+    )
+
+
+_suit_permutations: list[tuple[int, ...]] = list(permutations(range(4)))
+
+
+def _canonical_spot(
+    hand_ids: list[list[int]], board_ids: list[int], dead_ids: list[int]
+) -> tuple[tuple[tuple[int, ...], ...], tuple[int, ...], tuple[int, ...]]:
+    """
+    Relabels suits so that spots that only differ by a suit permutation share a cache entry.
+    Player order is kept.
+    """
+
+    def relabel(perm: tuple[int, ...]):
+        def ids(cards: list[int]) -> tuple[int, ...]:
+            return tuple(sorted((i & ~3) | perm[i & 3] for i in cards))
+
+        return (tuple(ids(h) for h in hand_ids), ids(board_ids), ids(dead_ids))
+
+    return min(relabel(perm) for perm in _suit_permutations)
+
+
+# optional second tier under the per-process cache, shared by every process on the machine
+shared_cache: Optional[SharedCache] = None
+
+_RESULT = struct.Struct("<Qd")
+_PLAYER = struct.Struct("<ddd")
+
+
+def use_shared_cache(cache: Optional[SharedCache]):
+    """
+    Looks exact results up in (and publishes them to) a SharedCache. Processes started with
+    POKER_SHARED_CACHE set to a cache's name attach to it on their first exact_equity call.
+    """
+    global shared_cache
+    shared_cache = cache
+
+
+def _shared() -> Optional[SharedCache]:
+    if shared_cache is None and "POKER_SHARED_CACHE" in os.environ:
+        use_shared_cache(SharedCache.attach(os.environ["POKER_SHARED_CACHE"]))
+
+    return shared_cache
+
+
+def _spot_key(
+    hand_ids: tuple[tuple[int, ...], ...], board_ids: tuple[int, ...], dead_ids: tuple[int, ...]
+) -> bytes:
+    # card ids are below 52, so 0xFF and 0xFE can separate the hands, board and dead cards
+    hands: bytes = b"".join(bytes(hand) + b"\xff" for hand in hand_ids)
+    return hands + bytes(board_ids) + b"\xfe" + bytes(dead_ids)
+
+
+def _pack_result(result: EquityResult) -> bytes:
+    return _RESULT.pack(result.samples, result.stderr) + b"".join(
+        _PLAYER.pack(p.win, p.tie, p.equity) for p in result.players
+    )
+
+
+def _unpack_result(data: bytes) -> EquityResult:
+    samples, stderr = _RESULT.unpack_from(data)
+    players: tuple[PlayerEquity, ...] = tuple(
+        PlayerEquity(*values) for values in _PLAYER.iter_unpack(data[_RESULT.size :])
+    )
+    return EquityResult(players, samples, stderr)
+
+
+@lru_cache(maxsize=4096)
+def _exact_cached(
+    hand_ids: tuple[tuple[int, ...], ...], board_ids: tuple[int, ...], dead_ids: tuple[int, ...]
+) -> EquityResult:
+    cache: Optional[SharedCache] = _shared()
+    if cache is None:
+        return _enumerate(hand_ids, board_ids, dead_ids)
+
+    key: bytes = _spot_key(hand_ids, board_ids, dead_ids)
+    data: Optional[bytes] = cache.get(key)
+    if data is not None:
+        return _unpack_result(data)
+
+    result: EquityResult = _enumerate(hand_ids, board_ids, dead_ids)
+    cache.put(key, _pack_result(result))
+    return result
+
+
+def exact_equity(
+    hands: list[list[Card]],
+    board: Optional[list[Card]] = None,
+    dead: Optional[list[Card]] = None,
+) -> EquityResult:
+    """
+    Exact win, tie and equity share over every remaining runout. samples is the number of
+    runouts. Results are cached per spot, up to a suit relabelling.
+    """
+    board = board or []
+    dead = dead or []
+    _validate(hands, board, dead)
+    spot = _canonical_spot(
+        [[c.id for c in hand] for hand in hands], [c.id for c in board], [c.id for c in dead]
+    )
+
+    return _exact_cached(*spot)
@@ -0,0 +1,191 @@
+"""
+Structured, non-blocking logging. The engine and server only ever log through their subsystem
+loggers (poker.engine, poker.server, ...) and never configure logging themselves; importing them
+leaves the root logger alone. A process that wants the logs calls configure():
+
+    poker.* record -> QueueHandler (enqueue only) -> queue -> QueueListener thread -> JSON lines
+
+The calling thread does nothing but a level check and a queue put: messages are formatted, and
+stdout or the log file written, on the listener's thread. When the queue is full, records are
+dropped and counted rather than blocking the game loop.
+
+Since formatting happens later, list, dict and set arguments are shallow-copied at the call, so a
+line shows the hand or board as it was when logged. Any other mutable argument must be passed as
+an immutable value or a copy.
+
+Each line is one JSON object: ts, level, logger, msg, plus any `extra=` fields of the call:
+
+    log.info("Action", extra={"seat": 2, "action": "raise", "amount": 40})
+"""
+
+from __future__ import annotations
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from typing import IO, Optional, Union
+
+ROOT = "poker"
+DEFAULT_QUEUE_SIZE = 65536
+
+# attributes every LogRecord has; anything else on a record came from extra=
+_STANDARD: frozenset[str] = frozenset(
+    vars(logging.LogRecord("", 0, "", 0, "", None, None)).keys() | {"message", "asctime"}
+)
+
+
+def get_logger(subsystem: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT}.{subsystem}")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        event: dict[str, object] = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD:
+                event[key] = value
+        if record.exc_info:
+            event["exc"] = self.formatException(record.exc_info)
+
+        return json.dumps(event, separators=(",", ":"), default=str)
+
+
+_MUTABLE = (list, dict, set, bytearray)
+
+
+def _frozen(arg: object) -> object:
+    return copy.copy(arg) if isinstance(arg, _MUTABLE) else arg
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records untouched, leaving all formatting to the listener, and drops them when the
+    queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped: int = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the stdlib formats the message here; instead only freeze what could change before the
+        # listener gets to it, e.g. a player's hand or the flop
+        args = record.args
+        if isinstance(args, tuple):
+            if any(isinstance(arg, _MUTABLE) for arg in args):
+                record.args = tuple(_frozen(arg) for arg in args)
+        elif args:
+            record.args = {key: _frozen(value) for key, value in args.items()}
+
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[_DroppingQueueHandler] = None
+# loggers whose level configure() set, reset by shutdown()
+_leveled: list[logging.Logger] = []
+
+
+def parse_levels(spec: str) -> dict[str, int]:
+    """
+    "engine=warning,server=debug" -> {"engine": WARNING, "server": DEBUG}. A bare level sets the
+    poker root, e.g. "info" or "info,engine=warning".
+    """
+    levels: dict[str, int] = {}
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        subsystem, _, level = part.rpartition("=")
+        levels[subsystem] = logging.getLevelName(level.upper())
+        if not isinstance(levels[subsystem], int):
+            raise ValueError(f"unknown log level {level!r}")
+
+    return levels
+
+
+def configure(
+    levels: Optional[dict[str, int]] = None,
+    output: Union[str, IO[str], None] = None,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+) -> logging.handlers.QueueListener:
+    """
+    Routes the poker.* loggers through a background writer. levels maps subsystems ("" for all of
+    them) to levels, INFO by default; output is a path to append to or a text stream, stderr by
+    default. Calling it again replaces the previous pipeline.
+    """
+    global _listener, _handler
+    shutdown()
+
+    target: logging.Handler = (
+        logging.FileHandler(output, encoding="utf-8")
+        if isinstance(output, str)
+        else logging.StreamHandler(output or sys.stderr)
+    )
+    target.setFormatter(JsonFormatter())
+
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    _handler = _DroppingQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, target)
+    _listener.start()
+
+    root: logging.Logger = logging.getLogger(ROOT)
+    root.addHandler(_handler)
+    # the pipeline owns poker.* output; don't print it again through the root logger
+    root.propagate = False
+    root.setLevel(logging.INFO)
+    _leveled.append(root)
+    for subsystem, level in (levels or {}).items():
+        logger: logging.Logger = get_logger(subsystem) if subsystem else root
+        logger.setLevel(level)
+        _leveled.append(logger)
+
+    return _listener
+
+
+def configure_from_env() -> logging.handlers.QueueListener:
+    """
+    configure() with levels from POKER_LOG_LEVELS (see parse_levels) and output to
+    POKER_LOG_FILE, or stderr when it's unset.
+    """
+    levels: dict[str, int] = parse_levels(os.environ.get("POKER_LOG_LEVELS", ""))
+    return configure(levels, os.environ.get("POKER_LOG_FILE"))
+
+
+def dropped() -> int:
+    return _handler.dropped if _handler is not None else 0
+
+
+def shutdown():
+    """
+    Writes out everything queued and detaches the pipeline.
+    """
+    global _listener, _handler
+    if _listener is None or _handler is None:
+        return
+
+    root: logging.Logger = logging.getLogger(ROOT)
+    root.removeHandler(_handler)
+    root.propagate = True
+    for logger in _leveled:
+        logger.setLevel(logging.NOTSET)
+    _leveled.clear()
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = _handler = None
+
+
+atexit.register(shutdown)
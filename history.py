@@ -0,0 +1,330 @@
+"""
+Append-only binary hand history. Every finished hand is one length-prefixed record in a segment
+file; segments are never rewritten, and a writer that starts up always opens a new one.
+
+Segment:  magic "PKHH" | version (u16) | reserved (u16), then records
+Record:   body length (u32) | crc32 of body (u32) | body
+Body:     hand id (u64) | seats (u8) | board cards (u8) | actions (u16)
+          | small blind (u32) | big blind (u32) | dealer (i8)
+          seats   x  stack before blinds (i32) | chips after the hand (i32) | 2 hole cards (u8)
+                     | still in at showdown (u8)
+          board   x  card id (u8)
+          actions x  street (u8) | seat (u8) | code (u8) | amount (u32)
+          names   x  length (u8) | UTF-8
+
+All integers are little-endian, card ids are rank * 4 + suit (see Card) and 0xFF is "no card".
+The fixed-size sections come first, so readers can pull numbers out of the memory-mapped segment
+with struct.unpack_from (HAND, SEAT, ACTION, NAME below) without touching the names.
+"""
+
+from __future__ import annotations
+import argparse
+import logging
+import mmap
+import os
+import queue
+import re
+import struct
+import threading
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional, Union
+from main import Action, Table, community_cards
+
+MAGIC = b"PKHH"
+VERSION = 1
+SUFFIX = ".hhl"
+NO_CARD = 0xFF
+
+DEFAULT_SEGMENT_BYTES = 64 << 20
+DEFAULT_SYNC_EVERY = 256
+
+_SEGMENT_HEADER = struct.Struct("<4sHH")
+_RECORD = struct.Struct("<II")
+HAND = struct.Struct("<QBBHIIb")
+SEAT = struct.Struct("<iiBBB")
+ACTION = struct.Struct("<BBBI")
+NAME = struct.Struct("<B")
+
+log: logging.Logger = logging.getLogger("poker.history")
+
+
+@dataclass
+class HandRecord:
+    hand_id: int
+    small_blind: int
+    big_blind: int
+    dealer: int
+    names: list[str]
+    stacks: list[int]
+    chips: list[int]
+    hole_cards: list[tuple[int, ...]]
+    active: list[bool]
+    board: tuple[int, ...]
+    # (street, seat, action), street indexing into STREETS
+    actions: list[tuple[int, int, Action]]
+
+
+def encode_hand(table: Table, hand_id: int) -> bytes:
+    """
+    Packs the hand the table just finished into a record body.
+    """
+    players = table.players
+    board: list[int] = [card.id for card in community_cards(table)]
+    stacks: tuple[int, ...] = table.stacks or tuple(p.chips for p in players)
+    parts: list[bytes] = [
+        HAND.pack(
+            hand_id,
+            len(players),
+            len(board),
+            len(table.action_log),
+            table.small_blind,
+            table.big_blind,
+            table.dealer,
+        )
+    ]
+    for p, stack in zip(players, stacks):
+        cards: list[int] = [card.id for card in p.hand[:2]]
+        cards += [NO_CARD] * (2 - len(cards))
+        parts.append(SEAT.pack(stack, p.chips, cards[0], cards[1], p.is_active))
+    parts.append(bytes(board))
+    for street, seat, action in table.action_log:
+        parts.append(ACTION.pack(street, seat, action.code, action.value or 0))
+    for p in players:
+        name: bytes = p.name.encode()[:255]
+        parts.append(NAME.pack(len(name)) + name)
+
+    return b"".join(parts)
+
+
+def decode_hand(body: Union[bytes, memoryview]) -> HandRecord:
+    hand_id, seats, board_len, action_count, small_blind, big_blind, dealer = HAND.unpack_from(
+        body
+    )
+    pos: int = HAND.size
+    stacks: list[int] = []
+    chips: list[int] = []
+    hole_cards: list[tuple[int, ...]] = []
+    active: list[bool] = []
+    for _ in range(seats):
+        stack, end, first, second, still_in = SEAT.unpack_from(body, pos)
+        pos += SEAT.size
+        stacks.append(stack)
+        chips.append(end)
+        hole_cards.append(tuple(card for card in (first, second) if card != NO_CARD))
+        active.append(bool(still_in))
+
+    board: tuple[int, ...] = tuple(body[pos : pos + board_len])
+    pos += board_len
+
+    actions: list[tuple[int, int, Action]] = []
+    for _ in range(action_count):
+        street, seat, code, value = ACTION.unpack_from(body, pos)
+        pos += ACTION.size
+        actions.append((street, seat, Action(code, value or None)))
+
+    names: list[str] = []
+    for _ in range(seats):
+        (length,) = NAME.unpack_from(body, pos)
+        names.append(bytes(body[pos + 1 : pos + 1 + length]).decode())
+        pos += 1 + length
+
+    return HandRecord(
+        hand_id, small_blind, big_blind, dealer, names, stacks, chips, hole_cards, active, board,
+        actions,
+    )
+
+
+def _segment_path(directory: Path, prefix: str, number: int) -> Path:
+    return directory / f"{prefix}-{number:06d}{SUFFIX}"
+
+
+def _segment_number(path: Path) -> int:
+    return int(path.stem.rsplit("-", 1)[1])
+
+
+def segments(directory: Union[str, Path], prefix: Optional[str] = None) -> list[Path]:
+    """
+    Segment files in the directory, in write order per prefix. prefix=None lists every writer's.
+    """
+    pattern = re.compile(rf"{re.escape(prefix) if prefix is not None else '.+'}-\d{{6}}")
+    paths: list[Path] = [
+        path for path in Path(directory).glob(f"*{SUFFIX}") if pattern.fullmatch(path.stem)
+    ]
+    return sorted(paths, key=lambda path: (path.stem.rsplit("-", 1)[0], _segment_number(path)))
+
+
+class HistoryWriter:
+    """
+    Buffers encoded hands in memory and hands every sync_every of them to a background thread,
+    which appends the batch to the current segment and fsyncs it. record() never touches the disk,
+    so it's safe to call from the event loop. A batch never spans segments; a new segment starts
+    once the current one is past segment_bytes.
+
+    Hand ids are (segment number at open << 32) + hands recorded, so they stay unique across
+    restarts of a writer with the same prefix.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        prefix: str = "hands",
+        *,
+        segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+        sync_every: int = DEFAULT_SYNC_EVERY,
+    ):
+        self.directory: Path = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.prefix: str = prefix
+        self.segment_bytes: int = segment_bytes
+        self.sync_every: int = sync_every
+
+        existing: list[Path] = segments(self.directory, prefix)
+        self._segment: int = _segment_number(existing[-1]) + 1 if existing else 0
+        self._next_id: int = self._segment << 32
+        self._buffer: list[bytes] = []
+        self._batches: queue.SimpleQueue[Optional[bytes]] = queue.SimpleQueue()
+        self._error: Optional[BaseException] = None
+        self._thread: threading.Thread = threading.Thread(
+            target=self._write_batches, name=f"history-{prefix}", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self) -> HistoryWriter:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, table: Table) -> int:
+        """
+        Queues the table's finished hand and returns its hand id.
+        """
+        if self._error is not None:
+            raise self._error
+
+        hand_id: int = self._next_id
+        self._next_id += 1
+        body: bytes = encode_hand(table, hand_id)
+        self._buffer.append(_RECORD.pack(len(body), zlib.crc32(body)) + body)
+        if len(self._buffer) >= self.sync_every:
+            self.flush()
+
+        return hand_id
+
+    def flush(self):
+        """
+        Hands the buffered records to the writer thread.
+        """
+        if self._buffer:
+            self._batches.put(b"".join(self._buffer))
+            self._buffer.clear()
+
+    def close(self):
+        """
+        Writes out everything recorded so far and waits for it to reach the disk.
+        """
+        self.flush()
+        self._batches.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _write_batches(self):
+        file = None
+        size: int = 0
+        try:
+            while (batch := self._batches.get()) is not None:
+                if file is None or size >= self.segment_bytes:
+                    if file is not None:
+                        file.close()
+                        self._segment += 1
+                    file = open(_segment_path(self.directory, self.prefix, self._segment), "xb")
+                    file.write(_SEGMENT_HEADER.pack(MAGIC, VERSION, 0))
+                    size = _SEGMENT_HEADER.size
+
+                file.write(batch)
+                file.flush()
+                os.fsync(file.fileno())
+                size += len(batch)
+        except BaseException as e:
+            self._error = e
+            log.exception("Hand history writer failed")
+        finally:
+            if file is not None:
+                file.close()
+
+
+class HistoryReader:
+    """
+    Memory-maps segments one at a time and walks their records in order. A torn record at the end
+    of a segment (a crash mid-batch) ends that segment's stream with a warning.
+    """
+
+    def __init__(self, directory: Union[str, Path], prefix: Optional[str] = None):
+        self.paths: list[Path] = segments(directory, prefix)
+
+    @classmethod
+    def from_paths(cls, paths: list[Path]) -> HistoryReader:
+        reader: HistoryReader = cls.__new__(cls)
+        reader.paths = list(paths)
+
+        return reader
+
+    def records(self, verify: bool = True) -> Iterator[memoryview]:
+        """
+        Record bodies as memoryviews into the mapped segment, without copying. A view is only
+        valid until the iterator moves on to the next record; decode_hand() copies what it needs.
+        """
+        for path in self.paths:
+            with open(path, "rb") as file:
+                if os.fstat(file.fileno()).st_size <= _SEGMENT_HEADER.size:
+                    continue
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    data: memoryview = memoryview(mapped)
+                    try:
+                        yield from self._walk(path, data, verify)
+                    finally:
+                        data.release()
+
+    def _walk(self, path: Path, data: memoryview, verify: bool) -> Iterator[memoryview]:
+        magic, version, _ = _SEGMENT_HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} hand history segment")
+
+        pos: int = _SEGMENT_HEADER.size
+        end: int = len(data)
+        while pos < end:
+            if pos + _RECORD.size > end:
+                log.warning("%s: torn record header at byte %d", path, pos)
+                return
+            length, crc = _RECORD.unpack_from(data, pos)
+            start: int = pos + _RECORD.size
+            if start + length > end:
+                log.warning("%s: torn record at byte %d", path, pos)
+                return
+
+            body: memoryview = data[start : start + length]
+            try:
+                if verify and zlib.crc32(body) != crc:
+                    raise ValueError(f"{path}: checksum mismatch at byte {pos}")
+                yield body
+            finally:
+                body.release()
+            pos = start + length
+
+    def __iter__(self) -> Iterator[HandRecord]:
+        for body in self.records():
+            yield decode_hand(body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a hand history directory")
+    parser.add_argument("directory")
+    parser.add_argument("--prefix", default=None)
+    args = parser.parse_args()
+
+    reader = HistoryReader(args.directory, args.prefix)
+    hands: int = sum(1 for _ in reader.records())
+    print(f"{hands} hands in {len(reader.paths)} segments")
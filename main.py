@@ -1,14 +1,21 @@
 from __future__ import annotations
 import random
+from array import array
 from enum import Enum, IntEnum, auto
-from itertools import product, combinations
+from itertools import combinations
 from collections import Counter
-from typing import Optional, cast, Iterable
+from typing import Awaitable, Callable, Iterable, Iterator, Optional, cast
 from dataclasses import dataclass, field
-from copy import deepcopy
+from copy import copy
+from pathlib import Path
 import logging
+import mmap
+import os
+import struct
+import sys
+import zlib
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+log: logging.Logger = logging.getLogger("poker.engine")
 
 
 class Suit(Enum):
@@ -60,9 +67,40 @@ rank_symbols = {
 
 
 class Card:
-    def __init__(self, suit: Suit, rank: Rank):
-        self.suit: Suit = suit
-        self.rank: Rank = rank
+    """
+    One of 52 interned, immutable cards. Card(suit, rank) always returns the same object, so cards
+    compare and hash by identity and copying a hand never copies the cards.
+
+    id is rank * 4 + suit (0-51), rank_bit and suit_bit are one-hot masks of the rank and suit, and
+    mask is the card's bit in a 52-bit hand/board mask.
+    """
+
+    __slots__ = ("suit", "rank", "id", "rank_bit", "suit_bit", "mask")
+
+    suit: Suit
+    rank: Rank
+    id: int
+    rank_bit: int
+    suit_bit: int
+    mask: int
+
+    def __new__(cls, suit: Suit, rank: Rank) -> Card:
+        return _card_table[rank * 4 + suit.value - 1]
+
+    def __setattr__(self, name: str, value: object):
+        raise AttributeError("Card is immutable")
+
+    def __delattr__(self, name: str):
+        raise AttributeError("Card is immutable")
+
+    def __copy__(self) -> Card:
+        return self
+
+    def __deepcopy__(self, memo: dict) -> Card:
+        return self
+
+    def __reduce__(self):
+        return (Card, (self.suit, self.rank))
 
     def __str__(self):
         return f"{suit_symbols[self.suit]} {rank_symbols[self.rank]}"
@@ -71,25 +109,112 @@ class Card:
         return self.__str__()
 
 
+def _make_card(card_id: int) -> Card:
+    card: Card = object.__new__(Card)
+    suit_idx: int = card_id & 3
+    for name, value in (
+        ("suit", Suit(suit_idx + 1)),
+        ("rank", Rank(card_id >> 2)),
+        ("id", card_id),
+        ("rank_bit", 1 << (card_id >> 2)),
+        ("suit_bit", 1 << suit_idx),
+        ("mask", 1 << card_id),
+    ):
+        object.__setattr__(card, name, value)
+
+    return card
+
+
+_card_table: list[Card] = [_make_card(i) for i in range(52)]
+
+
+def card_from_id(card_id: int) -> Card:
+    return _card_table[card_id]
+
+
+def cards_to_mask(cards: Iterable[Card]) -> int:
+    mask: int = 0
+    for c in cards:
+        mask |= c.mask
+
+    return mask
+
+
+def mask_to_cards(mask: int) -> list[Card]:
+    """
+    Cards of a 52-bit mask in id order.
+    """
+    cards: list[Card] = []
+    while mask:
+        low: int = mask & -mask
+        cards.append(_card_table[low.bit_length() - 1])
+        mask ^= low
+
+    return cards
+
+
+def rng_stream(seed: Optional[int], stream: int = 0) -> random.Random:
+    """
+    Independent RNG for one table or simulation worker. The same (seed, stream) pair always
+    gives the same sequence; a None seed draws fresh OS entropy.
+    """
+    if seed is None:
+        return random.Random()
+
+    return random.Random(f"{seed}/{stream}")
+
+
 class Deck:
-    def __init__(self):
-        # Create all combinations of suits and ranks using itertools.product
-        self.cards: list[Card] = [
-            Card(suit, rank)
-            for suit, rank in product(
-                cast(Iterable[Suit], Suit), cast(Iterable[Rank], Rank)
-            )
-        ]  # pyrefly: ignore
+    """
+    Card ids in a preallocated array. ids[:top] have been dealt; draws do a partial Fisher-Yates
+    shuffle of the undealt tail, swapping each drawn card down to top. Any permutation of the array
+    is a valid starting point for the next shuffle, so reset() just rewinds top.
+    """
+
+    def __init__(self, seed: Optional[int] = None, rng: Optional[random.Random] = None):
+        self.rng: random.Random = rng or rng_stream(seed)
+        self.ids: array[int] = array("B", range(52))
+        self.top: int = 0
+
+    def __len__(self) -> int:
+        return 52 - self.top
+
+    @property
+    def cards(self) -> list[Card]:
+        return [_card_table[i] for i in self.ids[self.top :]]
+
+    def reset(self):
+        self.top = 0
+
+    def draw_ids(self, count: int) -> list[int]:
+        top: int = self.top
+        if not 0 <= count <= 52 - top:
+            raise ValueError(f"Cannot draw {count} cards from a deck of {52 - top}")
+
+        ids: array[int] = self.ids
+        rand = self.rng.random
+        for i in range(top, top + count):
+            j: int = i + int(rand() * (52 - i))
+            ids[i], ids[j] = ids[j], ids[i]
+
+        self.top = top + count
+        return ids[top : self.top].tolist()
 
     def draw(self, count: int) -> list[Card]:
-        # Shuffle isn't required because sample already returns random elements from the list
-        cards_drawn = random.sample(self.cards, count)
-        for card in cards_drawn:
-            self.cards.remove(card)
+        return [_card_table[i] for i in self.draw_ids(count)]
 
-        return cards_drawn
+    def remove(self, cards: Iterable[Card]):
+        """
+        Takes known cards (e.g. dead cards or a fixed board) out of the undealt part of the deck.
+        """
+        self.remove_ids(c.id for c in cards)
 
-    # TODO: Perhaps use an iterator? So that I don't have to do .cards
+    def remove_ids(self, card_ids: Iterable[int]):
+        ids: array[int] = self.ids
+        for card_id in card_ids:
+            j: int = ids.index(card_id, self.top)
+            ids[self.top], ids[j] = ids[j], ids[self.top]
+            self.top += 1
 
 
 class HandRank(IntEnum):
@@ -133,11 +258,47 @@ class Action:
                 raise ValueError("You've raised without specifying an amount.")
 
 
+def parse_action(text: str) -> Optional[Action]:
+    """
+    Parses a typed action: a code or name, plus an amount for raises ("3 100", "raise 100").
+    Returns None if the text isn't a valid action.
+    """
+    names: dict[str, int] = {"check": 1, "call": 2, "raise": 3, "fold": 4}
+    parts: list[str] = text.strip().lower().split()
+    if not parts or not 1 <= len(parts) <= 2:
+        return None
+
+    code: Optional[int] = names.get(parts[0])
+    if code is None and parts[0].isdecimal():
+        code = int(parts[0])
+    if code is None or (len(parts) == 2 and not parts[1].isdecimal()):
+        return None
+
+    try:
+        return Action(code, int(parts[1]) if len(parts) == 2 else None)
+    except ValueError:
+        return None
+
+
+# Picks an action for the player at the given seat. Used instead of input() when no script is set.
+Strategy = Callable[["Table", int], Action]
+# Async counterpart of Strategy, e.g. waiting on a player's websocket.
+ActionSource = Callable[["Table", int], Awaitable[Action]]
+
+STREETS: tuple[str, ...] = ("Pre-Flop", "Flop", "Turn", "River")
+
+
 @dataclass
 class Table:
+    """
+    Table state is mutated in place. Every change made through update() is recorded in the undo
+    journal as (object, attribute, old value), so a checkpoint() can be rolled back without copying
+    the table. Callers that need an immutable view take a snapshot().
+    """
+
     small_blind: int
     big_blind: int
-    last_player: Player = field(init=False)
+    last_player: Optional[Player] = field(init=False, default=None)
     turn_card: Optional[Card] = None
     river_card: Optional[Card] = None
     players: list[Player] = field(default_factory=list)
@@ -146,141 +307,287 @@ class Table:
     dealer: int = -1
     flop_cards: list[Card] = field(default_factory=list)
     player_actions: Optional[list[list[Action]]] = None
+    strategy: Optional[Strategy] = None
+    journal: list[tuple[object, str, object]] = field(
+        init=False, repr=False, default_factory=list
+    )
+    # street index into STREETS, and every accepted (street, seat, action) of the current hand
+    street: int = field(init=False, default=0)
+    action_log: tuple[tuple[int, int, Action], ...] = field(init=False, repr=False, default=())
+    # chips of each seat before the blinds of the current hand
+    stacks: tuple[int, ...] = field(init=False, repr=False, default=())
+    # each active player's best hand with the board dealt so far, kept current street by street,
+    # and the board ids those strengths were computed against
+    hole_keys: dict[Player, CardKey] = field(init=False, repr=False, default_factory=dict)
+    strengths: dict[Player, int] = field(init=False, repr=False, default_factory=dict)
+    strength_board: tuple[int, ...] = field(init=False, repr=False, default=())
+    # called as observer(obj, attr, value) after every change made through update() or rollback()
+    observers: list[Callable[[object, str, object], None]] = field(
+        init=False, repr=False, default_factory=list
+    )
 
     def __post_init__(self):
         self.current_bet = self.big_blind
         if self.players:
             self.last_player = self.players[0]
 
+    def update(self, obj: object, attr: str, value: object):
+        self.journal.append((obj, attr, getattr(obj, attr)))
+        setattr(obj, attr, value)
+        for observer in self.observers:
+            observer(obj, attr, value)
+
+    def checkpoint(self) -> int:
+        return len(self.journal)
+
+    def rollback(self, mark: int = 0):
+        """
+        Undoes every change recorded since the checkpoint, newest first.
+        """
+        journal = self.journal
+        while len(journal) > mark:
+            obj, attr, old = journal.pop()
+            setattr(obj, attr, old)
+            for observer in self.observers:
+                observer(obj, attr, old)
+
+    def commit(self):
+        self.journal.clear()
+
+    def snapshot(self) -> Table:
+        """
+        Independent copy of the current state. Cards are interned and never copied, and the undo
+        journal is left behind.
+        """
+        players: list[Player] = []
+        for p in self.players:
+            copy_p: Player = Player(p.name, p.chips)
+            copy_p.hand = list(p.hand)
+            copy_p.is_active = p.is_active
+            players.append(copy_p)
+
+        deck: Deck = Deck(rng=copy(self.deck.rng))
+        deck.ids = array("B", self.deck.ids)
+        deck.top = self.deck.top
+
+        table: Table = Table(
+            self.small_blind,
+            self.big_blind,
+            turn_card=self.turn_card,
+            river_card=self.river_card,
+            players=players,
+            deck=deck,
+            pot_size=self.pot_size,
+            dealer=self.dealer,
+            flop_cards=list(self.flop_cards),
+            player_actions=[list(r) for r in self.player_actions]
+            if self.player_actions is not None
+            else None,
+            strategy=self.strategy,
+        )
+        table.current_bet = self.current_bet
+        table.street = self.street
+        table.action_log = self.action_log
+        table.stacks = self.stacks
+        copies: dict[Player, Player] = dict(zip(self.players, players))
+        table.hole_keys = {copies[p]: key for p, key in self.hole_keys.items() if p in copies}
+        table.strengths = {copies[p]: s for p, s in self.strengths.items() if p in copies}
+        table.strength_board = self.strength_board
+        if self.last_player is not None:
+            table.last_player = players[self.players.index(self.last_player)]
+
+        return table
+
     def begin_game(self):
         return self.pre_game().pre_flop().flop().turn().river().showdown().players
 
-    def start_betting(self, first_player: Optional[int] = None) -> Table:
+    async def begin_game_async(self, source: ActionSource) -> list[Player]:
+        """
+        Plays a whole hand, awaiting each action from source instead of blocking on input(), so
+        many tables can share one event loop.
         """
-        Goes around the table asking players for actions until the current round is over. Then, returns
-        a new table instance.
+        self.pre_game()
+        for street in STREETS:
+            self._open_street(street)
+            first_player: Optional[int] = self.dealer + 3 if street == "Pre-Flop" else None
+            await self.start_betting_async(source, first_player)
+            self._close_street(street)
+
+        return self.showdown().players
+
+    def betting_order(self, first_player: Optional[int] = None) -> Iterator[int]:
+        """
+        Seats of the active players, in the order they act this round. Stops as soon as fewer than
+        two players are left in the hand, so the last one is never asked to act.
         """
-        mod_table: Table = deepcopy(self)
         first_player = first_player or (self.dealer + 1)
+        for i in range(len(self.players)):
+            if sum(p.is_active for p in self.players) < 2:
+                return
+            current_player_idx = (first_player + i) % len(self.players)
+            if self.players[current_player_idx].is_active:
+                yield current_player_idx
+
+    def start_betting(self, first_player: Optional[int] = None) -> Table:
+        """
+        Goes around the table asking active players for actions until the current round is over.
+        Actions come from the action script, then the strategy, then input().
+        """
         test_action: Optional[list[Action]] = None
+        mark: int = self.checkpoint()
 
-        if mod_table.player_actions:
-            test_action = mod_table.player_actions.pop(0)
+        if self.player_actions:
+            test_action = self.player_actions.pop(0)
 
-        if test_action is not None:
-            for i in range(len(self.players)):
-                current_player_idx = (first_player + i) % len(self.players)
-                current_action: Action = test_action.pop(0)
+        for current_player_idx in self.betting_order(first_player):
+            if test_action is not None or self.strategy is not None:
+                current_action: Action = (
+                    test_action.pop(0)
+                    if test_action is not None
+                    else cast(Strategy, self.strategy)(self, current_player_idx)
+                )
 
-                if (
-                    handle_player_action(mod_table, current_player_idx, current_action)
-                    is None
-                ):
+                if self._act(current_player_idx, current_action) is None:
+                    self.rollback(mark)
                     raise ValueError(f"Incorrect action: {current_action}")
-        else:
-            for i in range(len(self.players)):
-                current_player_idx = (first_player + i) % len(self.players)
-                action: int = int(
-                    input(
-                        f"{self.players[current_player_idx].name}, choose an action (check (0), call (1), raise (2), fold (3). Current bet to call: {self.current_bet}: "
-                    )
-                )
-                if action == 2:
-                    raise_amt: int = int(input("enter raise amount: "))
-                    action_arg: Action = Action(2, raise_amt)
-                else:
-                    action_arg: Action = Action(action)
-
-                while not handle_player_action(
-                    mod_table, current_player_idx, action_arg
-                ):
-                    action: int = int(
-                        input(
-                            f"{self.players[current_player_idx].name}, choose an action (check (0), call (1), raise (2), fold (3). Current bet to call: {self.current_bet}: "
-                        )
-                    )
-                    if action == "raise":
-                        raise_amt: int = int(input("enter raise amount: "))
-                        action_arg: Action = Action(2, raise_amt)
-                    else:
-                        action_arg: Action = Action(action)
-
-        return mod_table
+                continue
 
-    def pre_game(self):
-        mod_table: Table = deepcopy(self)
-        # set dealer, move blinds, dealing hole cards
-        mod_players: list[Player] = mod_table.players
+            prompt: str = (
+                f"{self.players[current_player_idx].name}, choose an action (check (1), call (2), "
+                f"raise (3) <amount>, fold (4)). Current bet to call: {self.current_bet}: "
+            )
+            action: Optional[Action] = parse_action(input(prompt))
+            while action is None or not self._act(current_player_idx, action):
+                action = parse_action(input(prompt))
+
+        return self
 
-        logging.info("=== Starting Pre-Game ===")
-        mod_pot: int = mod_table.pot_size
+    def _act(self, seat: int, action: Action) -> Optional[Table]:
+        # handle_player_action, plus a record of the action for the hand history
+        if handle_player_action(self, seat, action) is None:
+            return None
+        self.update(self, "action_log", self.action_log + ((self.street, seat, action),))
 
-        # collect blinds
-        mod_players[self.dealer + 1].chips -= self.small_blind
-        mod_players[self.dealer + 2].chips -= self.big_blind
+        return self
+
+    async def start_betting_async(
+        self, source: ActionSource, first_player: Optional[int] = None
+    ) -> Table:
+        """
+        Same betting round as start_betting, but awaits every action from source. A rejected
+        action is asked for again.
+        """
+        for current_player_idx in self.betting_order(first_player):
+            action: Action = await source(self, current_player_idx)
+            while self._act(current_player_idx, action) is None:
+                action = await source(self, current_player_idx)
 
-        # move to pot
-        mod_pot += mod_table.small_blind + mod_table.big_blind
+        return self
+
+    def pre_game(self):
+        # set dealer, move blinds, dealing hole cards
+        log.info("=== Starting Pre-Game ===")
+        self.commit()
+        self.update(self, "stacks", tuple(p.chips for p in self.players))
+        self.update(self, "action_log", ())
+        self.update(self.deck, "top", 0)
+        self.update(self, "flop_cards", [])
+        self.update(self, "turn_card", None)
+        self.update(self, "river_card", None)
+
+        players: list[Player] = self.players
+        small_blind_player: Player = players[(self.dealer + 1) % len(players)]
+        big_blind_player: Player = players[(self.dealer + 2) % len(players)]
+
+        # collect blinds and move them to the pot
+        self.update(small_blind_player, "chips", small_blind_player.chips - self.small_blind)
+        self.update(big_blind_player, "chips", big_blind_player.chips - self.big_blind)
+        self.update(self, "pot_size", self.pot_size + self.small_blind + self.big_blind)
 
         # dealing hole cards
-        for p in mod_players:
-            hole_cards: list[Card] = mod_table.deck.draw(2)
-            p.hand = hole_cards
+        for p in players:
+            self.update(p, "is_active", True)
+            self.update(p, "hand", self._deal(2))
+        self.update(self, "hole_keys", {p: card_key(c.id for c in p.hand) for p in players})
+        self.track_strengths()
+
+        self.update(self, "current_bet", self.big_blind)
+
+        return self
+
+    def _deal(self, count: int) -> list[Card]:
+        self.update(self.deck, "top", self.deck.top)
+        return self.deck.draw(count)
+
+    def _open_street(self, street: str):
+        log.info("=== Starting %s ===", street)
+        self.update(self, "street", STREETS.index(street))
+        if street == "Flop":
+            self.update(self, "flop_cards", self._deal(3))
+            log.info("Flop cards: %s", self.flop_cards)
+        elif street == "Turn":
+            self.update(self, "turn_card", self._deal(1)[0])
+            log.info("Turn card: %s", self.turn_card)
+        elif street == "River":
+            self.update(self, "river_card", self._deal(1)[0])
+            log.info("River card: %s", self.river_card)
+        if street != "Pre-Flop":
+            self.track_strengths()
+
+    def track_strengths(self):
+        """
+        Brings every active player's made-hand strength up to date with the board. The board's
+        evaluator key is built once and each player only adds their hole cards' key to it.
+        """
+        board_ids: tuple[int, ...] = tuple(c.id for c in community_cards(self))
+        hole_keys: dict[Player, CardKey] = self.hole_keys
+        for p in self.players:
+            if p.is_active and len(p.hand) == 2 and p not in hole_keys:
+                hole_keys = {**hole_keys, p: card_key(c.id for c in p.hand)}
+        if hole_keys is not self.hole_keys:
+            self.update(self, "hole_keys", hole_keys)
+
+        active: list[Player] = [p for p in self.players if p.is_active and p in hole_keys]
+        if len(board_ids) < 3:
+            strengths: dict[Player, int] = {p: hole_strength(hole_keys[p]) for p in active}
+        else:
+            board: CardKey = card_key(board_ids)
+            strengths = {p: evaluate_keys(board, hole_keys[p]) for p in active}
 
-        mod_table.current_bet = mod_table.big_blind
+        self.update(self, "strengths", strengths)
+        self.update(self, "strength_board", board_ids)
 
-        return mod_table
+    def _close_street(self, street: str):
+        log.info("=== Ending %s ===", street)
+        self.update(self, "current_bet", 0)
 
     def pre_flop(self):
-        logging.info("=== Starting Pre-Flop ===")
-        mod_table: Table = deepcopy(self)
-        mod_table.start_betting(mod_table.dealer + 3)
-        logging.info("=== Ending Pre-Flop ===")
-        mod_table.current_bet = 0
+        self._open_street("Pre-Flop")
+        self.start_betting(self.dealer + 3)
+        self._close_street("Pre-Flop")
 
-        return mod_table
+        return self
 
     def flop(self):
-        logging.info("=== Starting Flop ===")
-        mod_table: Table = deepcopy(self)
-        flop: list[Card] = mod_table.deck.draw(3)
-        mod_table.flop_cards = flop
-
-        logging.info(f"Flop cards: {mod_table.flop_cards}")
-        mod_table.start_betting()
-        logging.info("=== Ending Flop ===")
-
-        mod_table.current_bet = 0
+        self._open_street("Flop")
+        self.start_betting()
+        self._close_street("Flop")
 
-        return mod_table
+        return self
 
     def turn(self):
-        logging.info("=== Starting Turn ===")
-        mod_table: Table = deepcopy(self)
-        turn: Card = mod_table.deck.draw(1)[0]
-        mod_table.turn_card = turn
-
-        logging.info(f"Turn card: {mod_table.turn_card}")
-        mod_table.start_betting()
-        logging.info("=== Ending Turn ===")
-
-        mod_table.current_bet = 0
+        self._open_street("Turn")
+        self.start_betting()
+        self._close_street("Turn")
 
-        return mod_table
+        return self
 
     def river(self):
-        logging.info("=== Starting River ===")
-        mod_table: Table = deepcopy(self)
-        river: Card = mod_table.deck.draw(1)[0]
-        mod_table.river_card = river
-
-        logging.info(f"River card: {mod_table.river_card}")
-        mod_table.start_betting()
-        logging.info("=== Ending River ===")
-
-        mod_table.current_bet = 0
+        self._open_street("River")
+        self.start_betting()
+        self._close_street("River")
 
-        return mod_table
+        return self
 
     def deal_community_cards(self):
         raise NotImplementedError
@@ -307,100 +614,136 @@ class Table:
         """
 
     def showdown(self):
-        mod_table: Table = deepcopy(self)
-
-        logging.info("=== Starting Showdown ===")
-        for p in mod_table.players:
-            logging.info(f"{p.name} - {p.hand}")
-
-        player_ranks: dict[Player, tuple[HandRank, list[Card]]] = evaluate_table(
-            mod_table
-        )
-
-        for p in player_ranks:
-            print(f"{p} - {player_ranks[p]}")
-        player_chips: dict[Player, int] = {}
-        player_chips = dict(sorted(player_chips.items(), key=lambda x: x[1]))
+        log.info("=== Starting Showdown ===")
+        for p in self.players:
+            log.info("%s - %s", p.name, p.hand)
+
+        winners: list[Player] = [p for p in self.players if p.is_active]
+        if len(winners) > 1:
+            player_strengths: dict[Player, int] = evaluate_table_strengths(self)
+            for p in player_strengths:
+                log.info("%s - %r", p, strength_rank(player_strengths[p]))
+
+            # split the pot between the best hands; odd chips go to the first winner
+            best: int = max(player_strengths.values())
+            winners = [p for p, s in player_strengths.items() if s == best]
+        elif winners:
+            # everyone else folded: the pot goes to the last player without a showdown
+            log.info("%s wins uncontested", winners[0])
+        else:
+            raise ValueError("Nobody is left in the hand")
+        share, remainder = divmod(self.pot_size, len(winners))
+        for i, p in enumerate(winners):
+            self.update(p, "chips", p.chips + share + (remainder if i == 0 else 0))
+        self.update(self, "pot_size", 0)
 
-        for p in player_chips.items():
-            logging.info(f"{p[0]} - {p[1]}")
-        logging.info("=== Ending Showdown ===\n")
+        for p in sorted(self.players, key=lambda p: p.chips):
+            log.info("%s - %d", p, p.chips)
+        log.info("=== Ending Showdown ===\n")
 
-        return mod_table
+        return self
 
 
 def handle_player_action(
     table: Table, player_idx: int, action: Action
 ) -> Optional[Table]:
     """
-    Returns a new table with modified states based on player actions
+    Applies a player action to the table in place. Returns the table, or None (with nothing
+    changed) if the action isn't allowed.
     """
-    mod_table: Table = deepcopy(table)
+    player: Player = table.players[player_idx]
 
     match action.code:
         case 1:
-            if mod_table.current_bet > 0:
-                print("Cannot check. Minimum bet placed.")
+            if table.current_bet > 0:
+                log.info("Cannot check. Minimum bet placed.", extra={"seat": player_idx})
                 return None
 
-            return mod_table
+            return table
 
         case 2:
-            mod_table.pot_size += mod_table.current_bet
-            mod_table.players[player_idx].chips -= mod_table.current_bet
-            return mod_table
+            table.update(table, "pot_size", table.pot_size + table.current_bet)
+            table.update(player, "chips", player.chips - table.current_bet)
+            return table
 
         case 3:
             assert action.value is not None
             raise_amt: int = action.value
-            
-            if raise_amt >= mod_table.players[player_idx].chips:
-                print("Error: Raise is greater than available chips")
+
+            if raise_amt >= player.chips:
+                log.info(
+                    "Error: Raise is greater than available chips",
+                    extra={"seat": player_idx, "amount": raise_amt},
+                )
                 return None
 
             if raise_amt < 2 * table.current_bet:
-                print("Minimum raise has to be twice the current bet")
+                log.info(
+                    "Minimum raise has to be twice the current bet",
+                    extra={"seat": player_idx, "amount": raise_amt},
+                )
                 return None
 
-            mod_table.current_bet = raise_amt
-            mod_table.players[player_idx].chips -= raise_amt
-            mod_table.pot_size += raise_amt
-            mod_table.last_player = mod_table.players[player_idx]
-            return mod_table
+            table.update(table, "current_bet", raise_amt)
+            table.update(player, "chips", player.chips - raise_amt)
+            table.update(table, "pot_size", table.pot_size + raise_amt)
+            table.update(table, "last_player", player)
+            return table
 
         case 4:
-            mod_table.players[player_idx].is_active = False
-            return mod_table
+            table.update(player, "is_active", False)
+            return table
 
     return None
 
 
-def evaluate_table(table: Table) -> dict[Player, tuple[HandRank, list[Card]]]:
-    community_cards: list[Card] = cast(
-        list[Card], table.flop_cards + [table.river_card, table.turn_card]
-    )
-    player_ranks: dict[Player, tuple[HandRank, list[Card]]] = dict()
+def community_cards(table: Table) -> list[Card]:
+    board: list[Card] = list(table.flop_cards)
+    if table.turn_card is not None:
+        board.append(table.turn_card)
+    if table.river_card is not None:
+        board.append(table.river_card)
 
-    for player in table.players:
-        all_hand_combos = list(combinations(player.hand + community_cards, 5))
+    return board
 
-        best_hand_cards: list[Card] = list(all_hand_combos[0])
-        best_hand_rank: HandRank = evaluate_hand(best_hand_cards)
 
-        for hand in all_hand_combos:
-            # print(hand, evaluate_hand(list(hand)))
-            hand_eval: HandRank = evaluate_hand(list(hand))
+def evaluate_table_strengths(table: Table) -> dict[Player, int]:
+    """
+    Scores every active player's hole cards plus the board with the lookup evaluator. Returns
+    players mapped to their hand strength, strongest first. This is the showdown hot path: when the
+    table has tracked strengths for the current board (see Table.track_strengths) they are reused
+    rather than evaluated again.
+    """
+    board_ids: list[int] = [c.id for c in community_cards(table)]
+    tracked: dict[Player, int] = table.strengths
+    active: list[Player] = [player for player in table.players if player.is_active]
+    if (
+        len(board_ids) >= 3
+        and table.strength_board == tuple(board_ids)
+        and all(player in tracked for player in active)
+    ):
+        player_strengths: dict[Player, int] = {player: tracked[player] for player in active}
+    else:
+        player_strengths = {
+            player: evaluate_ids([c.id for c in player.hand] + board_ids) for player in active
+        }
 
-            if hand_eval > best_hand_rank:
-                best_hand_cards = list(hand)
-                best_hand_rank = hand_eval
+    return dict(sorted(player_strengths.items(), key=lambda x: x[1], reverse=True))
 
-        player_ranks[player] = (best_hand_rank, best_hand_cards)
 
-    # sort by ranks
-    player_ranks = dict(
-        sorted(player_ranks.items(), key=lambda x: x[1][0], reverse=True)
-    )
+def evaluate_table(table: Table) -> dict[Player, tuple[HandRank, list[Card]]]:
+    board: list[Card] = community_cards(table)
+    player_ranks: dict[Player, tuple[HandRank, list[Card]]] = dict()
+
+    for player, strength in evaluate_table_strengths(table).items():
+        # the strength is already known, so stop at the first five-card combo that reaches it
+        best_hand_cards: list[Card] = next(
+            list(hand)
+            for hand in combinations(player.hand + board, 5)
+            if evaluate_cards(hand) == strength
+        )
+        player_ranks[player] = (strength_rank(strength), best_hand_cards)
+
     return player_ranks
 
 
@@ -468,5 +811,320 @@ def evaluate_hand(hand: list[Card]) -> HandRank:
         return HandRank.HIGH_CARD
 
 
+# --- Lookup-table evaluator ---
+#
+# Cards are encoded as ids 0-51 (rank * 4 + suit). A hand's strength is a single int laid out as
+# the HandRank in the top bits followed by up to five 4-bit ranks in tie-break order, so comparing
+# two strengths compares category first and then kickers.
+#
+# Scoring sums a per-card rank key (5 ** rank, so the sum is the rank multiset in base 5) and a
+# per-card suit key (a 3-bit counter per suit). The suit sum tells in one lookup whether a flush is
+# present; if it isn't, the rank sum indexes straight into the non-flush table. Otherwise the
+# flushing suit's rank bitmask indexes the flush table.
+#
+# Unlike evaluate_hand, the wheel (A-2-3-4-5) counts as a five-high straight here.
+
+STRENGTH_SHIFT = 20
+
+_card_rank_key: list[int] = [5 ** (i >> 2) for i in range(52)]
+_card_suit_key: list[int] = [1 << (3 * (i & 3)) for i in range(52)]
+_card_rank_bit: list[int] = [1 << (i >> 2) for i in range(52)]
+
+# rank bitmasks of every straight, highest first, paired with the straight's top rank
+_straights: list[tuple[int, int]] = [
+    (0b11111 << (high - 4), high) for high in range(Rank.ACE, Rank.FIVE, -1)
+] + [((1 << Rank.ACE) | 0b1111, Rank.FIVE)]
+
+
+def _strength(category: HandRank, ranks: Iterable[int]) -> int:
+    strength: int = category
+    count: int = 0
+    for r in ranks:
+        strength = (strength << 4) | r
+        count += 1
+
+    return strength << (4 * (5 - count))
+
+
+def _ranks_desc(mask: int) -> list[int]:
+    return [r for r in range(Rank.ACE, -1, -1) if mask >> r & 1]
+
+
+def _straight_high(mask: int) -> Optional[int]:
+    for straight, high in _straights:
+        if mask & straight == straight:
+            return high
+
+    return None
+
+
+def _flush_strength(mask: int) -> int:
+    high: Optional[int] = _straight_high(mask)
+    if high == Rank.ACE:
+        return _strength(HandRank.ROYAL_FLUSH, [high])
+    if high is not None:
+        return _strength(HandRank.STRAIGHT_FLUSH, [high])
+
+    return _strength(HandRank.FLUSH, _ranks_desc(mask)[:5])
+
+
+def _multiset_strength(counts: list[int]) -> int:
+    """
+    Best non-flush strength of a rank multiset. counts[r] is the number of cards of rank r.
+    """
+    by_count: list[list[int]] = [[] for _ in range(5)]
+    for r in range(Rank.ACE, -1, -1):
+        by_count[counts[r]].append(r)
+
+    quads, trips, pairs, singles = by_count[4], by_count[3], by_count[2], by_count[1]
+
+    if quads:
+        kicker: int = max(r for r in range(13) if counts[r] and r != quads[0])
+        return _strength(HandRank.FOUR_OF_A_KIND, [quads[0], kicker])
+
+    if trips and (len(trips) > 1 or pairs):
+        pair: int = max(trips[1:] + pairs)
+        return _strength(HandRank.FULL_HOUSE, [trips[0], pair])
+
+    mask: int = sum(1 << r for r in range(13) if counts[r])
+    high: Optional[int] = _straight_high(mask)
+    if high is not None:
+        return _strength(HandRank.STRAIGHT, [high])
+
+    if trips:
+        return _strength(HandRank.THREE_OF_A_KIND, [trips[0]] + singles[:2])
+
+    if len(pairs) > 1:
+        kicker = max(pairs[2:] + singles)
+        return _strength(HandRank.TWO_PAIR, pairs[:2] + [kicker])
+
+    if pairs:
+        return _strength(HandRank.PAIR, [pairs[0]] + singles[:3])
+
+    return _strength(HandRank.HIGH_CARD, singles[:5])
+
+
+def _build_noflush_table() -> dict[int, int]:
+    """
+    Strengths of every 5-, 6- and 7-card rank multiset, keyed by the base-5 rank sum.
+    """
+    table: dict[int, int] = {}
+    counts: list[int] = [0] * 13
+
+    def fill(rank: int, cards: int, key: int) -> None:
+        if rank == 13:
+            if cards >= 5:
+                table[key] = _multiset_strength(counts)
+            return
+
+        for n in range(min(4, 7 - cards) + 1):
+            counts[rank] = n
+            fill(rank + 1, cards + n, key + n * 5**rank)
+        counts[rank] = 0
+
+    fill(0, 0, 0)
+    return table
+
+
+def _build_flush_suit_table() -> list[int]:
+    table: list[int] = [-1] * (1 << 12)
+    for suits in range(1 << 12):
+        for suit in range(4):
+            if (suits >> (3 * suit)) & 0b111 >= 5:
+                table[suits] = suit
+
+    return table
+
+
+# The tables take most of a second to generate, so they're saved to EVAL_TABLES_PATH the first
+# time and memory-mapped by every later import (and every worker process) instead:
+#
+#     magic "PKEV" | version (u16) | reserved (u16) | fingerprint (u32) | non-flush entries (u32)
+#     | crc32 of body (u32), then sorted non-flush keys (u32) | their strengths (u32)
+#     | flush table (u32 x 8192) | flush suit table (i8 x 4096)
+#
+# in native byte order. A missing, corrupt or stale file (see _tables_fingerprint) is rebuilt.
+
+EVAL_TABLES_PATH: Path = Path(
+    os.environ.get("POKER_EVAL_TABLES", Path(__file__).with_name("eval_tables.bin"))
+)
+_TABLES_MAGIC = b"PKEV"
+_TABLES_VERSION = 1
+_tables_header = struct.Struct("<4sHHIII")
+
+EvalTables = tuple[memoryview, memoryview, memoryview, memoryview]
+
+
+def _tables_fingerprint() -> int:
+    # strengths embed HandRank values, so reordering HandRank makes every saved strength stale
+    ranks: list[tuple[str, int]] = [(rank.name, rank.value) for rank in HandRank]
+    return zlib.crc32(repr((STRENGTH_SHIFT, ranks, sys.byteorder)).encode())
+
+
+def _build_tables() -> list[array]:
+    noflush: dict[int, int] = _build_noflush_table()
+    keys: array[int] = array("I", sorted(noflush))
+    return [
+        keys,
+        array("I", [noflush[key] for key in keys]),
+        array(
+            "I", [_flush_strength(mask) if mask.bit_count() >= 5 else 0 for mask in range(1 << 13)]
+        ),
+        array("b", _build_flush_suit_table()),
+    ]
+
+
+def save_tables(path: Path = EVAL_TABLES_PATH) -> list[array]:
+    """
+    Generates the lookup tables and writes them to path atomically. Returns the tables.
+    """
+    tables: list[array] = _build_tables()
+    body: bytes = b"".join(table.tobytes() for table in tables)
+    tmp: Path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(
+            _tables_header.pack(
+                _TABLES_MAGIC, _TABLES_VERSION, 0, _tables_fingerprint(), len(tables[0]),
+                zlib.crc32(body),
+            )
+        )
+        f.write(body)
+    os.replace(tmp, path)
+
+    return tables
+
+
+def _map_tables(path: Path) -> Optional[EvalTables]:
+    try:
+        with open(path, "rb") as f:
+            mapped: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if len(mapped) < _tables_header.size:
+        return None
+    magic, version, _, fingerprint, entries, crc = _tables_header.unpack_from(mapped)
+    body: memoryview = memoryview(mapped)[_tables_header.size :]
+    if (
+        (magic, version, fingerprint) != (_TABLES_MAGIC, _TABLES_VERSION, _tables_fingerprint())
+        or len(body) != 8 * entries + 4 * (1 << 13) + (1 << 12)
+        or zlib.crc32(body) != crc
+    ):
+        return None
+
+    flush: int = 8 * entries
+    return (
+        body[: 4 * entries].cast("I"),
+        body[4 * entries : flush].cast("I"),
+        body[flush : flush + 4 * (1 << 13)].cast("I"),
+        body[flush + 4 * (1 << 13) :].cast("b"),
+    )
+
+
+def load_tables(path: Path = EVAL_TABLES_PATH) -> EvalTables:
+    """
+    The lookup tables as views over the memory-mapped file, regenerating it first if it's
+    missing or stale. Falls back to tables in memory when the file can't be written.
+    """
+    tables: Optional[EvalTables] = _map_tables(path)
+    if tables is not None:
+        return tables
+
+    log.info("Generating evaluator tables at %s", path)
+    try:
+        built: list[array] = save_tables(path)
+    except OSError:
+        log.warning("Can't write %s, keeping the evaluator tables in memory", path)
+        built = _build_tables()
+
+    return _map_tables(path) or cast(EvalTables, tuple(memoryview(table) for table in built))
+
+
+# views over the shared mapping (batch_eval reads them directly), and the plain dict and lists
+# the scalar evaluator indexes, which are faster to index than a memoryview
+_noflush_keys, _noflush_values, _flush_view, _flush_suit_view = load_tables()
+_noflush_table: dict[int, int] = dict(zip(_noflush_keys, _noflush_values))
+_flush_table: list[int] = _flush_view.tolist()
+_flush_suit_table: list[int] = _flush_suit_view.tolist()
+
+
+def evaluate_ids(ids: Iterable[int]) -> int:
+    """
+    Strength of the best five-card hand among 5 to 7 card ids. Higher is better.
+    """
+    ids = list(ids)
+    rank_key: int = 0
+    suit_key: int = 0
+    for i in ids:
+        rank_key += _card_rank_key[i]
+        suit_key += _card_suit_key[i]
+
+    flush_suit: int = _flush_suit_table[suit_key]
+    if flush_suit < 0:
+        return _noflush_table[rank_key]
+
+    mask: int = 0
+    for i in ids:
+        if i & 3 == flush_suit:
+            mask |= _card_rank_bit[i]
+
+    return _flush_table[mask]
+
+
+# Keys of disjoint card sets add up: (rank key sum, suit key sum, rank bitmask per suit). Build the
+# board's key once per street, add each player's hole key to it, and the sum indexes the same
+# tables evaluate_ids uses.
+CardKey = tuple[int, int, tuple[int, int, int, int]]
+
+
+def card_key(ids: Iterable[int]) -> CardKey:
+    rank_key: int = 0
+    suit_key: int = 0
+    masks: list[int] = [0, 0, 0, 0]
+    for i in ids:
+        rank_key += _card_rank_key[i]
+        suit_key += _card_suit_key[i]
+        masks[i & 3] |= _card_rank_bit[i]
+
+    return rank_key, suit_key, (masks[0], masks[1], masks[2], masks[3])
+
+
+def evaluate_keys(board: CardKey, hole: CardKey) -> int:
+    """
+    Strength of the best five-card hand in the union of two disjoint card sets of 5 to 7 cards in
+    total, e.g. the board and a player's hole cards.
+    """
+    flush_suit: int = _flush_suit_table[board[1] + hole[1]]
+    if flush_suit < 0:
+        return _noflush_table[board[0] + hole[0]]
+
+    return _flush_table[board[2][flush_suit] | hole[2][flush_suit]]
+
+
+# made hand of two hole cards on their own (a pocket pair or high card), keyed by rank key sum
+_hole_table: dict[int, int] = {
+    5**high + 5**low: _strength(HandRank.PAIR, [high])
+    if high == low
+    else _strength(HandRank.HIGH_CARD, [high, low])
+    for high in range(13)
+    for low in range(high + 1)
+}
+
+
+def hole_strength(hole: CardKey) -> int:
+    """
+    Strength of two hole cards before the flop. Comparable with board strengths.
+    """
+    return _hole_table[hole[0]]
+
+
+def evaluate_cards(cards: Iterable[Card]) -> int:
+    return evaluate_ids(c.id for c in cards)
+
+
+def strength_rank(strength: int) -> HandRank:
+    return HandRank(strength >> STRENGTH_SHIFT)
+
+
 if __name__ == "__main__":
     raise NotImplementedError
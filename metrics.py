@@ -0,0 +1,263 @@
+"""
+Opt-in instrumentation. Nothing is measured until enable(), which swaps timing wrappers in for
+the table's street methods and the hot functions of main.py; disable() puts the originals back,
+so a process that never enables metrics runs exactly the code it always did. The counter calls
+left in server.py cost a flag check when disabled.
+
+serve() exposes everything in the Prometheus text format on a local HTTP port and samples the
+event loop's lag. Every timed call is also passed to the hooks, as hook(name, seconds), which is
+where a profiler or a slow-call logger plugs in:
+
+    metrics.add_hook(lambda name, seconds: seconds > 0.01 and log.warning("slow %s", name))
+"""
+
+from __future__ import annotations
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Any, Callable, Optional
+import main
+from main import Table
+
+PREFIX = "poker"
+DEFAULT_PORT = 9100
+LAG_INTERVAL = 0.5
+
+log: logging.Logger = logging.getLogger("poker.metrics")
+
+# upper bounds in seconds, 1us to 10s in 1-2.5-5 steps
+BUCKETS: tuple[float, ...] = tuple(
+    step * 10.0**exponent for exponent in range(-6, 1) for step in (1, 2.5, 5)
+) + (10.0,)
+
+Hook = Callable[[str, float], None]
+
+
+class Histogram:
+    def __init__(self, bounds: tuple[float, ...] = BUCKETS):
+        self.bounds: tuple[float, ...] = bounds
+        # the last bucket is everything past the largest bound
+        self.counts: list[int] = [0] * (len(bounds) + 1)
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-th quantile (inf if it's past the last one).
+        """
+        rank: float = q * self.count
+        seen: int = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+
+        return float("inf")
+
+
+enabled: bool = False
+histograms: defaultdict[str, Histogram] = defaultdict(Histogram)
+counters: defaultdict[str, int] = defaultdict(int)
+# read when scraped, so they cost nothing in between
+gauges: dict[str, Callable[[], float]] = {}
+hooks: list[Hook] = []
+
+# (owner, attribute, metric name, called with the result after each call)
+_TIMED: tuple[tuple[Any, str, str, Optional[Callable[[Any], None]]], ...] = (
+    (Table, "pre_game", "pre_game", lambda _: count("hands_dealt")),
+    (Table, "showdown", "showdown", None),
+    (
+        main,
+        "handle_player_action",
+        "handle_player_action",
+        lambda result: count("invalid_actions") if result is None else None,
+    ),
+    (main, "evaluate_table", "evaluate_table", None),
+    (main, "evaluate_table_strengths", "evaluate_table_strengths", None),
+)
+_originals: dict[tuple[Any, str], Callable] = {}
+# Streets are timed from _open_street to _close_street rather than around pre_flop() and the
+# rest, because begin_game_async goes through those two and never the street methods. Start times
+# of the streets in progress, by id() of the table.
+_street_started: dict[int, float] = {}
+
+
+def _record(name: str, elapsed: float):
+    # looked up on every call, so a reset() doesn't detach the wrappers from the histograms
+    histograms[f"{name}_seconds"].observe(elapsed)
+    for hook in hooks:
+        hook(name, elapsed)
+
+
+def _timed(name: str, fn: Callable, after: Optional[Callable[[Any], None]]) -> Callable:
+    @functools.wraps(fn)
+    def timed(*args, **kwargs):
+        start: float = time.perf_counter()
+        result = fn(*args, **kwargs)
+        _record(name, time.perf_counter() - start)
+        if after is not None:
+            after(result)
+
+        return result
+
+    return timed
+
+
+def _timed_open(fn: Callable) -> Callable:
+    @functools.wraps(fn)
+    def open_street(table: Table, street: str):
+        _street_started[id(table)] = time.perf_counter()
+        return fn(table, street)
+
+    return open_street
+
+
+def _timed_close(fn: Callable) -> Callable:
+    @functools.wraps(fn)
+    def close_street(table: Table, street: str):
+        result = fn(table, street)
+        start: Optional[float] = _street_started.pop(id(table), None)
+        if start is not None:
+            # "Pre-Flop" -> pre_flop
+            _record(street.lower().replace("-", "_"), time.perf_counter() - start)
+
+        return result
+
+    return close_street
+
+
+def enable():
+    global enabled
+    if enabled:
+        return
+
+    wrapped: list[tuple[Any, str, Callable[[Callable], Callable]]] = [
+        (owner, attr, functools.partial(_timed, name, after=after))
+        for owner, attr, name, after in _TIMED
+    ]
+    wrapped += [(Table, "_open_street", _timed_open), (Table, "_close_street", _timed_close)]
+    for owner, attr, wrap in wrapped:
+        original: Callable = vars(owner)[attr]
+        _originals[(owner, attr)] = original
+        setattr(owner, attr, wrap(original))
+    enabled = True
+
+
+def disable():
+    global enabled
+    for (owner, attr), original in _originals.items():
+        setattr(owner, attr, original)
+    _originals.clear()
+    _street_started.clear()
+    enabled = False
+
+
+def reset():
+    histograms.clear()
+    counters.clear()
+
+
+def count(name: str, amount: int = 1):
+    if enabled:
+        counters[name] += amount
+
+
+def observe(name: str, value: float):
+    if enabled:
+        histograms[name].observe(value)
+
+
+def add_hook(hook: Hook):
+    hooks.append(hook)
+
+
+def remove_hook(hook: Hook):
+    hooks.remove(hook)
+
+
+def exposition() -> str:
+    """
+    Every metric in the Prometheus text exposition format.
+    """
+    lines: list[str] = []
+    for name, histogram in sorted(histograms.items()):
+        metric: str = f"{PREFIX}_{name}"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative: int = 0
+        for bound, bucket in zip(histogram.bounds, histogram.counts):
+            cumulative += bucket
+            lines.append(f'{metric}_bucket{{le="{bound:g}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+        lines.append(f"{metric}_sum {histogram.sum:.9g}")
+        lines.append(f"{metric}_count {histogram.count}")
+    for name, value in sorted(counters.items()):
+        lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+        lines.append(f"{PREFIX}_{name}_total {value}")
+    for name, read in sorted(gauges.items()):
+        lines.append(f"# TYPE {PREFIX}_{name} gauge")
+        lines.append(f"{PREFIX}_{name} {read():g}")
+
+    return "\n".join(lines) + "\n"
+
+
+async def watch_loop_lag(interval: float = LAG_INTERVAL):
+    """
+    Sleeps for interval over and over and records how late each wakeup is: time the loop spent
+    busy with something else.
+    """
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    while True:
+        start: float = loop.time()
+        await asyncio.sleep(interval)
+        observe("event_loop_lag_seconds", max(0.0, loop.time() - start - interval))
+
+
+async def _respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request: list[str] = (await reader.readline()).decode(errors="replace").split()
+        while (await reader.readline()).strip():
+            pass  # headers
+
+        if len(request) >= 2 and request[0] == "GET" and request[1] == "/metrics":
+            status, body = "200 OK", exposition().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str = "localhost", port: int = DEFAULT_PORT) -> asyncio.Server:
+    """
+    Enables metrics, starts sampling loop lag and serves GET /metrics until the returned server
+    is closed.
+    """
+    enable()
+    lag: asyncio.Task = asyncio.create_task(watch_loop_lag())
+    metrics_server: asyncio.Server = await asyncio.start_server(_respond, host, port)
+    metrics_server.get_loop().create_task(_stop_with(metrics_server, lag))
+    log.info("Metrics on http://%s:%d/metrics", host, port)
+
+    return metrics_server
+
+
+async def _stop_with(metrics_server: asyncio.Server, lag: asyncio.Task):
+    try:
+        await metrics_server.wait_closed()
+    finally:
+        lag.cancel()
@@ -0,0 +1,179 @@
+"""
+Outs and draws: for a player's hole cards on the flop or turn, which unseen cards improve their
+made hand, the category each one reaches, and how likely the hand is to have improved once the
+river is dealt.
+
+What depends only on the board (every next card and, on the flop, every turn and river pair, with
+their evaluator keys and what the board makes by itself) is worked out once per board and cached,
+so every seat and spectator at a table shares it. A player then costs one table lookup per card or
+runout, and their result is cached as well. Both caches are keyed by sorted card ids, so the order
+the board was dealt in doesn't matter.
+
+A card is an out when it lifts the player's hand category past both what they hold now and what
+the board makes on its own, so the hole cards have to play: pairing the board isn't an out for
+everyone at the table.
+"""
+
+from __future__ import annotations
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import combinations
+from types import MappingProxyType
+from typing import Iterable, Mapping
+from main import (
+    Card,
+    CardKey,
+    HandRank,
+    Player,
+    Table,
+    card_from_id,
+    card_key,
+    community_cards,
+    evaluate_ids,
+    evaluate_keys,
+    strength_rank,
+)
+
+
+@dataclass(frozen=True)
+class Out:
+    card: Card
+    category: HandRank
+
+
+# frozen, as results are cached and handed to every seat and spectator asking about the same hand
+@dataclass(frozen=True)
+class DrawAnalysis:
+    category: HandRank
+    outs: tuple[Out, ...]
+    # chance that the next card is an out, and that the hand has improved once the river is out
+    next_card: float
+    by_river: float
+    # chance of each final category at the river
+    river_categories: Mapping[HandRank, float]
+
+
+@dataclass
+class BoardAnalysis:
+    board: tuple[int, ...]
+    key: CardKey
+    # every unseen card as (id, key of the board with it, what the board makes with it alone)
+    next_cards: list[tuple[int, CardKey, HandRank]]
+    # on the flop, every unseen turn and river pair as (mask of the two, key, board category)
+    runouts: list[tuple[int, CardKey, HandRank]]
+
+
+def board_category(ids: Iterable[int]) -> HandRank:
+    """
+    What the community cards make by themselves. Fewer than five cards can only make pairs,
+    trips or quads.
+    """
+    ids = list(ids)
+    if len(ids) >= 5:
+        return strength_rank(evaluate_ids(ids))
+
+    counts: list[int] = sorted(Counter(i >> 2 for i in ids).values(), reverse=True) + [0]
+    if counts[0] == 4:
+        return HandRank.FOUR_OF_A_KIND
+    if counts[0] == 3:
+        return HandRank.THREE_OF_A_KIND
+    if counts[0] == 2:
+        return HandRank.TWO_PAIR if counts[1] == 2 else HandRank.PAIR
+    return HandRank.HIGH_CARD
+
+
+@lru_cache(maxsize=256)
+def _board_analysis(board: tuple[int, ...]) -> BoardAnalysis:
+    unseen: list[int] = [i for i in range(52) if i not in board]
+    next_cards: list[tuple[int, CardKey, HandRank]] = [
+        (i, card_key(board + (i,)), board_category(board + (i,))) for i in unseen
+    ]
+    runouts: list[tuple[int, CardKey, HandRank]] = []
+    if len(board) == 3:
+        for turn, river in combinations(unseen, 2):
+            full: tuple[int, ...] = board + (turn, river)
+            runouts.append(((1 << turn) | (1 << river), card_key(full), board_category(full)))
+
+    return BoardAnalysis(board, card_key(board), next_cards, runouts)
+
+
+def analyze_board(board: list[Card]) -> BoardAnalysis:
+    if len(board) not in (3, 4, 5):
+        raise ValueError("Outs need a flop, a turn or a river")
+    ids: tuple[int, ...] = tuple(sorted(c.id for c in board))
+    if len(set(ids)) != len(ids):
+        raise ValueError("The same card appears more than once")
+
+    return _board_analysis(ids)
+
+
+@lru_cache(maxsize=4096)
+def _draws(board: tuple[int, ...], hole: tuple[int, ...]) -> DrawAnalysis:
+    analysis: BoardAnalysis = _board_analysis(board)
+    hole_key: CardKey = card_key(hole)
+    hole_mask: int = (1 << hole[0]) | (1 << hole[1])
+    current: HandRank = strength_rank(evaluate_keys(analysis.key, hole_key))
+    if len(board) == 5:
+        return DrawAnalysis(current, (), 0.0, 0.0, MappingProxyType({current: 1.0}))
+
+    outs: list[Out] = []
+    finals: Counter[HandRank] = Counter()
+    for card, key, alone in analysis.next_cards:
+        if hole_mask >> card & 1:
+            continue
+        category: HandRank = strength_rank(evaluate_keys(key, hole_key))
+        finals[category] += 1
+        if category > current and category > alone:
+            outs.append(Out(card_from_id(card), category))
+    unseen: int = sum(finals.values())
+    next_card: float = len(outs) / unseen
+
+    if len(board) == 4:
+        # the next card is the river
+        improved: int = len(outs)
+    else:
+        finals.clear()
+        improved = 0
+        for mask, key, alone in analysis.runouts:
+            if mask & hole_mask:
+                continue
+            category = strength_rank(evaluate_keys(key, hole_key))
+            finals[category] += 1
+            improved += category > current and category > alone
+
+    total: int = sum(finals.values())
+    return DrawAnalysis(
+        current,
+        tuple(outs),
+        next_card,
+        improved / total,
+        MappingProxyType({category: count / total for category, count in sorted(finals.items())}),
+    )
+
+
+def analyze(hand: list[Card], board: list[Card]) -> DrawAnalysis:
+    """
+    Outs for two hole cards on a flop (3 cards) or turn (4). On the river nothing improves any
+    more: no outs and no chances. Results are cached per board and hand.
+    """
+    if len(hand) != 2:
+        raise ValueError("A hand needs exactly two hole cards")
+    analysis: BoardAnalysis = analyze_board(board)
+    hole: tuple[int, ...] = tuple(sorted(c.id for c in hand))
+    if hole[0] == hole[1] or set(hole) & set(analysis.board):
+        raise ValueError("The same card appears more than once")
+
+    return _draws(analysis.board, hole)
+
+
+def analyze_table(table: Table) -> dict[Player, DrawAnalysis]:
+    """
+    Outs of every active player at the table against the current board, keyed by player. Every
+    player shares the one analysis of the board. Empty before the flop.
+    """
+    board: list[Card] = community_cards(table)
+    if not board:
+        return {}
+
+    return {p: analyze(p.hand, board) for p in table.players if p.is_active and p.hand}
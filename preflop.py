@@ -0,0 +1,216 @@
+"""
+Preflop equities for the 169 starting-hand classes, precomputed by generate() into a small binary
+file and memory-mapped by the loader, so a lookup is two index computations and no parsing.
+
+File layout (little-endian): a header of magic, version, max opponents, class count and samples
+per entry, then a 169 x 169 float32 heads-up matrix (row class vs column class) and a
+169 x MAX_OPPONENTS float32 matrix of equity against 1..MAX_OPPONENTS random hands.
+"""
+
+from __future__ import annotations
+import argparse
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from pathlib import Path
+from typing import Optional
+from main import Card, Deck, Rank, Suit, evaluate_ids, rng_stream, rank_symbols
+
+MAGIC = b"PFEQ"
+VERSION = 1
+CLASSES = 169
+MAX_OPPONENTS = 8
+DEFAULT_PATH = Path(__file__).with_name("preflop_equity.bin")
+
+_header = struct.Struct("<4sHHII")
+
+
+def hand_class(hand: list[Card]) -> int:
+    """
+    Index of a two-card hand in the 13 x 13 starting-hand grid: pairs on the diagonal, suited
+    hands above it (row = high rank) and offsuit hands below it.
+    """
+    first, second = hand
+    high, low = max(first.rank, second.rank), min(first.rank, second.rank)
+    if first.suit == second.suit:
+        return high * 13 + low
+    return low * 13 + high
+
+
+def class_name(idx: int) -> str:
+    row, col = divmod(idx, 13)
+    high, low = max(row, col), min(row, col)
+    name: str = rank_symbols[Rank(high)].replace("10", "T") + rank_symbols[Rank(low)].replace("10", "T")
+    if row == col:
+        return name
+    return name + ("s" if row > col else "o")
+
+
+def class_combos(idx: int) -> list[tuple[int, int]]:
+    """
+    Every concrete hand in a class, as card id pairs.
+    """
+    row, col = divmod(idx, 13)
+    high, low = max(row, col), min(row, col)
+    combos: list[tuple[int, int]] = []
+    for s1 in range(4):
+        for s2 in range(4):
+            a, b = high * 4 + s1, low * 4 + s2
+            if a == b or (row == col and s1 >= s2):
+                continue
+            if (s1 == s2) == (row > col) or row == col:
+                combos.append((a, b))
+
+    return combos
+
+
+def _showdown(hands: list[list[int]], board: list[int]) -> float:
+    """
+    Pot share won by the first hand.
+    """
+    strengths: list[int] = [evaluate_ids(h + board) for h in hands]
+    best: int = max(strengths)
+    if strengths[0] != best:
+        return 0.0
+    return 1.0 / strengths.count(best)
+
+
+def _heads_up_row(row: int, samples: int, seed: Optional[int]) -> list[float]:
+    """
+    Equity of class row against every class col >= row.
+    """
+    rng = rng_stream(seed, row)
+    deck: Deck = Deck(rng=rng)
+    hero: list[tuple[int, int]] = class_combos(row)
+    equities: list[float] = []
+
+    for col in range(row, CLASSES):
+        matchups = [
+            (h, v) for h in hero for v in class_combos(col) if not set(h) & set(v)
+        ]
+        total: float = 0.0
+        for _ in range(samples):
+            h, v = matchups[int(rng.random() * len(matchups))]
+            deck.reset()
+            deck.remove_ids(h + v)
+            total += _showdown([list(h), list(v)], deck.draw_ids(5))
+        equities.append(total / samples)
+
+    return equities
+
+
+def _multiway_row(row: int, samples: int, seed: Optional[int]) -> list[float]:
+    """
+    Equity of class row against 1..MAX_OPPONENTS random hands.
+    """
+    rng = rng_stream(seed, CLASSES + row)
+    deck: Deck = Deck(rng=rng)
+    hero: list[tuple[int, int]] = class_combos(row)
+    equities: list[float] = []
+
+    for opponents in range(1, MAX_OPPONENTS + 1):
+        total: float = 0.0
+        for _ in range(samples):
+            h = hero[int(rng.random() * len(hero))]
+            deck.reset()
+            deck.remove_ids(h)
+            dealt: list[int] = deck.draw_ids(2 * opponents + 5)
+            hands = [list(h)] + [dealt[2 * i : 2 * i + 2] for i in range(opponents)]
+            total += _showdown(hands, dealt[2 * opponents :])
+        equities.append(total / samples)
+
+    return equities
+
+
+def generate(
+    path: Path = DEFAULT_PATH,
+    samples: int = 2000,
+    seed: Optional[int] = 0,
+    workers: Optional[int] = None,
+):
+    """
+    Computes both matrices by Monte Carlo with the project's evaluator and writes the file.
+    samples is the number of runouts per matrix entry.
+    """
+    heads_up: list[float] = [0.0] * (CLASSES * CLASSES)
+    multiway: list[float] = [0.0] * (CLASSES * MAX_OPPONENTS)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rows = range(CLASSES)
+        hu_rows = pool.map(_heads_up_row, rows, [samples] * CLASSES, [seed] * CLASSES)
+        mw_rows = pool.map(_multiway_row, rows, [samples] * CLASSES, [seed] * CLASSES)
+
+        for row, equities in zip(rows, hu_rows):
+            for col, eq in zip(range(row, CLASSES), equities):
+                # ties are split, so the two sides of a matchup always sum to one
+                heads_up[row * CLASSES + col] = 0.5 if row == col else eq
+                heads_up[col * CLASSES + row] = 0.5 if row == col else 1.0 - eq
+
+        for row, equities in zip(rows, mw_rows):
+            multiway[row * MAX_OPPONENTS : (row + 1) * MAX_OPPONENTS] = equities
+
+    tmp: Path = path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(_header.pack(MAGIC, VERSION, MAX_OPPONENTS, CLASSES, samples))
+        f.write(struct.pack(f"<{len(heads_up)}f", *heads_up))
+        f.write(struct.pack(f"<{len(multiway)}f", *multiway))
+    os.replace(tmp, path)
+
+
+class PreflopTable:
+    def __init__(self, path: Path = DEFAULT_PATH):
+        with open(path, "rb") as f:
+            self._mmap: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, max_opponents, classes, self.samples = _header.unpack_from(self._mmap)
+        if (magic, version, max_opponents, classes) != (MAGIC, VERSION, MAX_OPPONENTS, CLASSES):
+            raise ValueError(f"{path} is not a version {VERSION} preflop equity file")
+
+        body: memoryview = memoryview(self._mmap)[_header.size :]
+        split: int = 4 * CLASSES * CLASSES
+        self.heads_up: memoryview[float] = body[:split].cast("f")
+        end: int = split + 4 * CLASSES * MAX_OPPONENTS
+        self.multiway: memoryview[float] = body[split:end].cast("f")
+
+    def vs_hand(self, hand: list[Card], villain: list[Card]) -> float:
+        return self.heads_up[hand_class(hand) * CLASSES + hand_class(villain)]
+
+    def vs_random(self, hand: list[Card], opponents: int = 1) -> float:
+        if not 1 <= opponents <= MAX_OPPONENTS:
+            raise ValueError(f"opponents must be between 1 and {MAX_OPPONENTS}")
+        return self.multiway[hand_class(hand) * MAX_OPPONENTS + opponents - 1]
+
+
+_table: Optional[PreflopTable] = None
+
+
+def preflop_equity(
+    hand: list[Card], villain: Optional[list[Card]] = None, opponents: int = 1
+) -> float:
+    """
+    Equity of a player's hole cards before the flop, against a specific hand's class if villain
+    is given, otherwise against the given number of random hands.
+    """
+    global _table
+    if _table is None:
+        _table = PreflopTable()
+
+    if villain is not None:
+        return _table.vs_hand(hand, villain)
+    return _table.vs_random(hand, opponents)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the preflop equity file")
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", type=Path, default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    start: float = time.perf_counter()
+    generate(args.output, args.samples, args.seed, args.workers)
+    print(f"wrote {args.output} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,301 @@
+"""
+Wire protocol for the server. Every message is a Message; a codec turns it into what goes on the
+socket. TextCodec keeps the human-readable prompts (handy with any websocket client), BinaryCodec
+packs struct frames for machine clients:
+
+    version (u8) | type (u8) | fixed fields (little-endian) | optional tail
+
+The tail is UTF-8 text, one byte per card id (rank * 4 + suit, see Card) or a list of table state
+changes (see delta.py), each packed as field (u8) | seat (u8) | value. Binary clients ask for it
+with the BINARY_SUBPROTOCOL websocket subprotocol, everyone else gets text.
+"""
+
+from __future__ import annotations
+import struct
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Optional, Union
+from delta import Change, Field, Value
+from main import Action, HandRank, card_from_id, parse_action
+
+VERSION = 1
+BINARY_SUBPROTOCOL = f"poker.v{VERSION}"
+
+# seat number used for community cards in CARDS messages
+BOARD = 0xFF
+
+Payload = Union[str, bytes]
+
+
+class MsgType(IntEnum):
+    # server -> client
+    ASK_NAME = 1
+    ROOM_MENU = 2
+    ROOM = 3
+    ROOM_CREATED = 4
+    JOINED = 5
+    GAME_STARTED = 6
+    TURN = 7
+    CARDS = 8
+    HAND_OVER = 10
+    ERROR = 11
+    SNAPSHOT = 12
+    DELTA = 13
+    HAND_RANK = 14
+    # client -> server
+    HELLO = 20
+    CHOICE = 21
+    START = 22
+    ACTION = 23
+    RESYNC = 24
+    # both ways
+    CHAT = 30
+
+
+@dataclass(frozen=True)
+class Message:
+    type: MsgType
+    values: tuple[int, ...] = ()
+    text: str = ""
+    cards: tuple[int, ...] = ()
+    changes: tuple[Change, ...] = ()
+
+
+_HEADER = struct.Struct("<BB")
+_EMPTY = struct.Struct("<")
+_CHANGE = struct.Struct("<BB")
+_INT = struct.Struct("<i")
+_BYTE = struct.Struct("<B")
+
+# fixed fields and tail ("text", "cards" or None) of every message type
+_LAYOUTS: dict[MsgType, tuple[struct.Struct, Optional[str]]] = {
+    MsgType.ASK_NAME: (_EMPTY, None),
+    MsgType.ROOM_MENU: (_EMPTY, None),
+    MsgType.ROOM: (struct.Struct("<I"), "text"),  # room id, host name
+    MsgType.ROOM_CREATED: (struct.Struct("<I"), None),  # room id
+    MsgType.JOINED: (_EMPTY, "text"),  # player name
+    MsgType.GAME_STARTED: (_EMPTY, None),
+    MsgType.TURN: (struct.Struct("<BII"), "text"),  # seat, bet to call, pot, player name
+    MsgType.CARDS: (struct.Struct("<B"), "cards"),  # seat or BOARD
+    MsgType.HAND_OVER: (struct.Struct("<i"), "text"),  # chips (can be negative), player name
+    MsgType.ERROR: (_EMPTY, "text"),
+    MsgType.SNAPSHOT: (struct.Struct("<I"), "changes"),  # seq
+    MsgType.DELTA: (struct.Struct("<I"), "changes"),  # seq
+    MsgType.HAND_RANK: (struct.Struct("<BB"), None),  # street, HandRank
+    MsgType.HELLO: (_EMPTY, "text"),  # player name
+    MsgType.CHOICE: (struct.Struct("<I"), None),  # menu option or room id
+    MsgType.START: (_EMPTY, None),
+    MsgType.ACTION: (struct.Struct("<BI"), None),  # action code, amount (0 if none)
+    MsgType.RESYNC: (struct.Struct("<I"), None),  # last seq the client saw
+    MsgType.CHAT: (_EMPTY, "text"),
+}
+
+# plain int -> MsgType, cheaper than calling the enum on every frame
+_TYPES: dict[int, MsgType] = {int(msg_type): msg_type for msg_type in MsgType}
+
+
+def action_message(action: Action) -> Message:
+    return Message(MsgType.ACTION, (action.code, action.value or 0))
+
+
+def message_action(message: Message) -> Optional[Action]:
+    """
+    The Action carried by an ACTION message, or None if it isn't a valid one.
+    """
+    code, amount = message.values
+    try:
+        return Action(code, amount or None)
+    except ValueError:
+        return None
+
+
+def _pack_changes(changes: tuple[Change, ...]) -> bytes:
+    parts: list[bytes] = []
+    for field, seat, value in changes:
+        parts.append(_CHANGE.pack(field, seat))
+        match field:
+            case Field.BOARD if isinstance(value, tuple):
+                parts.append(_BYTE.pack(len(value)) + bytes(value))
+            case Field.NAME if isinstance(value, str):
+                name: bytes = value.encode()[:255]
+                parts.append(_BYTE.pack(len(name)) + name)
+            case Field.ACTIVE:
+                parts.append(_BYTE.pack(value))
+            case _:
+                parts.append(_INT.pack(value))
+
+    return b"".join(parts)
+
+
+def _unpack_changes(data: bytes) -> tuple[Change, ...]:
+    """
+    Raises struct.error, ValueError or UnicodeDecodeError on a malformed list.
+    """
+    changes: list[Change] = []
+    pos: int = 0
+    while pos < len(data):
+        field_code, seat = _CHANGE.unpack_from(data, pos)
+        field: Field = Field(field_code)
+        pos += _CHANGE.size
+        value: Value
+        if field in (Field.BOARD, Field.NAME):
+            (length,) = _BYTE.unpack_from(data, pos)
+            raw: bytes = data[pos + 1 : pos + 1 + length]
+            if len(raw) != length:
+                raise ValueError("truncated change")
+            value = tuple(raw) if field == Field.BOARD else raw.decode()
+            pos += 1 + length
+        elif field == Field.ACTIVE:
+            value = bool(_BYTE.unpack_from(data, pos)[0])
+            pos += _BYTE.size
+        else:
+            (value,) = _INT.unpack_from(data, pos)
+            pos += _INT.size
+        changes.append((field, seat, value))
+
+    return tuple(changes)
+
+
+class BinaryCodec:
+    binary: bool = True
+
+    def encode(self, message: Message) -> bytes:
+        layout, tail = _LAYOUTS[message.type]
+        frame: bytes = _HEADER.pack(VERSION, message.type) + layout.pack(*message.values)
+        if tail == "text":
+            frame += message.text.encode()
+        elif tail == "cards":
+            frame += bytes(message.cards)
+        elif tail == "changes":
+            frame += _pack_changes(message.changes)
+
+        return frame
+
+    def decode(self, data: Payload, expected: Optional[MsgType] = None) -> Optional[Message]:
+        """
+        Unpacks a frame. Returns None for text, a frame from another protocol version, an unknown
+        type, a malformed body or (when given) a type other than expected.
+        """
+        if not isinstance(data, bytes) or len(data) < _HEADER.size:
+            return None
+
+        version, type_code = _HEADER.unpack_from(data)
+        msg_type: Optional[MsgType] = _TYPES.get(type_code)
+        if version != VERSION or msg_type is None:
+            return None
+        if expected is not None and msg_type != expected:
+            return None
+
+        layout, tail = _LAYOUTS[msg_type]
+        body: bytes = data[_HEADER.size :]
+        if len(body) < layout.size or (tail is None and len(body) != layout.size):
+            return None
+
+        values: tuple[int, ...] = layout.unpack_from(body)
+        rest: bytes = body[layout.size :]
+        if tail == "text":
+            try:
+                return Message(msg_type, values, text=rest.decode())
+            except UnicodeDecodeError:
+                return None
+        if tail == "cards":
+            if any(card_id >= 52 for card_id in rest):
+                return None
+            return Message(msg_type, values, cards=tuple(rest))
+        if tail == "changes":
+            try:
+                return Message(msg_type, values, changes=_unpack_changes(rest))
+            except (struct.error, ValueError):
+                return None
+
+        return Message(msg_type, values)
+
+
+def _describe_changes(changes: tuple[Change, ...]) -> str:
+    parts: list[str] = []
+    for field, seat, value in changes:
+        if isinstance(value, tuple):
+            value = " ".join(str(card_from_id(card_id)) for card_id in value) or "-"
+        label: str = field.name.lower()
+        parts.append(f"{label}={value}" if field < Field.NAME else f"seat{seat}.{label}={value}")
+
+    return ", ".join(parts)
+
+
+class TextCodec:
+    """
+    The original plain-text prompts. Replies are parsed by what the server is waiting for: a name
+    for HELLO, a number for CHOICE, and "start", "resync <seq>", an action or chat otherwise.
+    """
+
+    binary: bool = False
+
+    def encode(self, message: Message) -> str:
+        values: tuple[int, ...] = message.values
+        match message.type:
+            case MsgType.ASK_NAME:
+                return "Enter your name:"
+            case MsgType.ROOM_MENU:
+                return "Create (1), join (2) or watch (3) a room?"
+            case MsgType.ROOM:
+                return f"{values[0]}. {message.text}'s room"
+            case MsgType.ROOM_CREATED:
+                return f"You are now the host of {values[0]}."
+            case MsgType.JOINED:
+                return f"{message.text} has joined the room"
+            case MsgType.GAME_STARTED:
+                return "Starting game..."
+            case MsgType.TURN:
+                return (
+                    f"{message.text}, choose an action (check (1), call (2), raise (3) <amount>, "
+                    f"fold (4)). Current bet to call: {values[1]}, pot: {values[2]}"
+                )
+            case MsgType.CARDS:
+                cards: str = ", ".join(str(card_from_id(card_id)) for card_id in message.cards)
+                return f"Board: {cards}" if values[0] == BOARD else f"Your cards: {cards}"
+            case MsgType.HAND_OVER:
+                return f"Hand over. {message.text} has {values[0]} chips."
+            case MsgType.HAND_RANK:
+                return f"Your hand: {HandRank(values[1]).name.replace('_', ' ').title()}"
+            case MsgType.SNAPSHOT | MsgType.DELTA:
+                return f"State {values[0]}: {_describe_changes(message.changes)}"
+            case MsgType.RESYNC:
+                return f"resync {values[0]}"
+            case MsgType.START:
+                return "start"
+            case MsgType.ACTION:
+                return f"{values[0]} {values[1]}" if values[1] else str(values[0])
+            case MsgType.CHOICE:
+                return str(values[0])
+            case _:
+                return message.text
+
+    def decode(self, data: Payload, expected: Optional[MsgType] = None) -> Optional[Message]:
+        text: str = data.decode(errors="replace") if isinstance(data, bytes) else data
+        match expected:
+            case MsgType.HELLO:
+                return Message(MsgType.HELLO, text=text)
+            case MsgType.CHOICE:
+                if not text.strip().isdecimal():
+                    return None
+                return Message(MsgType.CHOICE, (int(text),))
+
+        words: list[str] = text.split()
+        if words == ["start"]:
+            return Message(MsgType.START)
+        if len(words) == 2 and words[0] == "resync" and words[1].isdecimal():
+            return Message(MsgType.RESYNC, (int(words[1]),))
+        action: Optional[Action] = parse_action(text)
+        if action is not None:
+            return action_message(action)
+        return Message(MsgType.CHAT, text=text)
+
+
+Codec = Union[BinaryCodec, TextCodec]
+
+BINARY: BinaryCodec = BinaryCodec()
+TEXT: TextCodec = TextCodec()
+
+
+def codec_for(subprotocol: Optional[str]) -> Codec:
+    return BINARY if subprotocol == BINARY_SUBPROTOCOL else TEXT
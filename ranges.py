@@ -0,0 +1,477 @@
+"""
+Range-versus-range equity. A range is a weight (0-1) for each of the 1326 two-card combos, parsed
+from the usual notation:
+
+    "AKs, TT+, 76s-54s, A5s+, KQo, AsKh, QQ:0.5, random"
+
+Two ranges are enumerated exactly over every runout. Strengths for every (runout, combo) pair come
+out of the lookup tables in one vectorized pass, and only their order within a runout matters:
+a runout rarely has more than ~150 distinct strengths among all 1326 combos. So one side's
+weights are binned by (runout, strength rank), and a cumulative sum over the bins gives, for every
+combo of the other side at once, the weight it beats plus half the weight it ties.
+
+Card removal: hero combo i can only meet villain combo j when they share no card, a combo x combo
+mask that factors through the combo x card incidence matrix A as 1 - A Aᵀ + I (a combo shares two
+cards only with itself). So what i meets is everything, minus what holds either of its two cards,
+plus the identical combo that was subtracted twice. The per-card terms come from the same binning
+by (runout, card, strength rank), which keeps the work proportional to combos x runouts rather
+than combos² x runouts.
+
+Three or more ranges are sampled instead: deals are drawn in bulk and the ones where two hands or
+the runout collide are rejected.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass, field
+from itertools import combinations
+from math import comb
+from typing import Optional, Union
+import numpy as np
+from batch_eval import _flush, _flush_suit, _noflush_keys, _noflush_values, _rank_bit, _rank_key, \
+    _suit_key, evaluate_batch
+from main import Card, card_from_id
+from preflop import class_combos
+
+RANKS = "23456789TJQKA"
+SUITS = "shcd"
+
+COMBO_COUNT = 1326
+MAX_RUNOUTS = 2000
+SAMPLES = 100_000
+RUNOUT_CHUNK = 256
+
+# every two-card combo as (lower id, higher id); a range's weights are indexed the same way
+COMBOS: np.ndarray = np.array(list(combinations(range(52), 2)), dtype=np.int64)
+COMBO_MASKS: np.ndarray = (1 << COMBOS[:, 0]) | (1 << COMBOS[:, 1])
+
+# only the order of strengths matters here, so the lookup tables are re-keyed to each strength's
+# place among all of them (7462 hands and the table's empty entries)
+_strength_values: np.ndarray = np.unique(np.concatenate((_noflush_values, _flush)))
+_noflush_places: np.ndarray = np.searchsorted(_strength_values, _noflush_values)
+_flush_places: np.ndarray = np.searchsorted(_strength_values, _flush)
+
+_combo_index: np.ndarray = np.full((52, 52), -1, dtype=np.int64)
+_combo_index[COMBOS[:, 0], COMBOS[:, 1]] = np.arange(COMBO_COUNT)
+_combo_index[COMBOS[:, 1], COMBOS[:, 0]] = np.arange(COMBO_COUNT)
+
+
+@dataclass(eq=False)
+class Range:
+    weights: np.ndarray = field(default_factory=lambda: np.zeros(COMBO_COUNT))
+    text: str = ""
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.weights))
+
+    def combos(self) -> list[tuple[Card, Card]]:
+        return [combo_cards(int(i)) for i in np.flatnonzero(self.weights)]
+
+
+@dataclass
+class ComboEquity:
+    cards: tuple[Card, Card]
+    weight: float
+    equity: float
+
+    @property
+    def name(self) -> str:
+        return combo_name(self.cards)
+
+
+@dataclass
+class RangeEquity:
+    equity: float
+    combos: list[ComboEquity]
+
+
+@dataclass
+class RangeEquityResult:
+    ranges: list[RangeEquity]
+    # runouts enumerated heads-up, deals sampled multiway
+    runouts: int
+    exact: bool
+
+
+def combo_cards(index: int) -> tuple[Card, Card]:
+    """
+    The combo at index, higher card first.
+    """
+    low, high = COMBOS[index]
+    return card_from_id(int(high)), card_from_id(int(low))
+
+
+def combo_name(cards: tuple[Card, Card]) -> str:
+    """
+    "AsKh" style name of a two-card hand, higher card first.
+    """
+    return "".join(
+        RANKS[card.id >> 2] + SUITS[card.id & 3] for card in sorted(cards, key=lambda c: -c.id)
+    )
+
+
+def _hand_class(token: str) -> tuple[int, int, str]:
+    """
+    "AKs" -> (ACE, KING, "s"), "TT" -> (TEN, TEN, ""), "AK" -> (ACE, KING, "").
+    """
+    if len(token) not in (2, 3) or token[0] not in RANKS or token[1] not in RANKS:
+        raise ValueError(f"Unknown hand {token!r}")
+
+    high, low = sorted((RANKS.index(token[0]), RANKS.index(token[1])), reverse=True)
+    kind: str = token[2:]
+    if kind not in ("", "s", "o") or (high == low and kind):
+        raise ValueError(f"Unknown hand {token!r}")
+
+    return high, low, kind
+
+
+def _class_indices(high: int, low: int, kind: str) -> list[int]:
+    if high == low:
+        classes: list[int] = [high * 13 + high]
+    else:
+        # the preflop grid: suited above the diagonal, offsuit below it
+        classes = [high * 13 + low] * (kind != "o") + [low * 13 + high] * (kind != "s")
+
+    return [int(_combo_index[a, b]) for idx in classes for a, b in class_combos(idx)]
+
+
+def _expand(token: str) -> list[int]:
+    """
+    Combo indices of one comma-separated part of a range, weight already stripped.
+    """
+    if token in ("random", "any"):
+        return list(range(COMBO_COUNT))
+
+    if len(token) == 4 and token[1] in SUITS and token[3] in SUITS:
+        if token[0] not in RANKS or token[2] not in RANKS or token[:2] == token[2:]:
+            raise ValueError(f"Unknown hand {token!r}")
+        first, second = (RANKS.index(token[i]) * 4 + SUITS.index(token[i + 1]) for i in (0, 2))
+        return [int(_combo_index[first, second])]
+
+    if token.endswith("+"):
+        high, low, kind = _hand_class(token[:-1])
+        if high == low:
+            # TT+ climbs the pair, A5s+ the kicker up to just under the high card
+            return [i for rank in range(low, 13) for i in _class_indices(rank, rank, "")]
+        return [i for kicker in range(low, high) for i in _class_indices(high, kicker, kind)]
+
+    if "-" in token:
+        start, _, end = token.partition("-")
+        (high1, low1, kind1), (high2, low2, kind2) = _hand_class(start), _hand_class(end)
+        if kind1 != kind2:
+            raise ValueError(f"Mismatched ends in {token!r}")
+
+        if high1 == low1 and high2 == low2:
+            ranks: list[tuple[int, int]] = [
+                (r, r) for r in range(min(low1, low2), max(low1, low2) + 1)
+            ]
+        elif high1 == high2:
+            ranks = [(high1, k) for k in range(min(low1, low2), max(low1, low2) + 1)]
+        elif high1 - low1 == high2 - low2:
+            gap: int = high1 - low1
+            ranks = [(h, h - gap) for h in range(min(high1, high2), max(high1, high2) + 1)]
+        else:
+            raise ValueError(f"Can't span {token!r}")
+        return [i for high, low in ranks for i in _class_indices(high, low, kind1)]
+
+    return _class_indices(*_hand_class(token))
+
+
+def parse_range(text: str) -> Range:
+    """
+    Parses comma-separated hands, each optionally weighted as "hand:weight". A combo listed more
+    than once keeps the last weight given to it.
+    """
+    weights: np.ndarray = np.zeros(COMBO_COUNT)
+    for part in filter(None, (part.strip() for part in text.split(","))):
+        token, _, weight = part.partition(":")
+        value: float = float(weight) if weight else 1.0
+        if not 0.0 <= value <= 1.0:
+            raise ValueError(f"Weight out of range in {part!r}")
+        weights[_expand(token.strip())] = value
+
+    return Range(weights, text)
+
+
+def _runouts(
+    deck: np.ndarray, missing: int, max_runouts: int, rng: np.random.Generator
+) -> tuple[np.ndarray, bool]:
+    """
+    Every way to complete the board from deck, or max_runouts random ones if there are more.
+    """
+    total: int = comb(len(deck), missing)
+    if total <= max_runouts:
+        picks: np.ndarray = np.array(list(combinations(range(len(deck)), missing)), dtype=np.int64)
+        return deck[picks.reshape(total, missing)], True
+
+    picks = np.argsort(rng.random((max_runouts, len(deck))), axis=1)[:, :missing]
+    return deck[picks], False
+
+
+def _suit_bits(cards: np.ndarray) -> np.ndarray:
+    """
+    (..., n) card ids -> (..., 4) rank bits of the cards of each suit.
+    """
+    suited: np.ndarray = (cards[..., None] & 3) == np.arange(4)
+    return np.where(suited, _rank_bit[cards][..., None], 0).sum(axis=-2)
+
+
+def _strengths(board: np.ndarray, runouts: np.ndarray, combos: np.ndarray) -> np.ndarray:
+    """
+    (runouts, combos) strengths of board + runout + combo, as places in _strength_values.
+    """
+    run_rank: np.ndarray = _rank_key[board].sum() + _rank_key[runouts].sum(axis=1)
+    # only 91 distinct rank pairs among the combos: look each up once per runout
+    pair_keys, pair_of = np.unique(_rank_key[combos].sum(axis=1), return_inverse=True)
+    noflush: np.ndarray = np.searchsorted(_noflush_keys, run_rank[:, None] + pair_keys[None, :])
+    # a combo that collides with the runout has no real hand; it's masked out later
+    np.minimum(noflush, len(_noflush_keys) - 1, out=noflush)
+    strengths: np.ndarray = _noflush_places[noflush][:, pair_of]
+
+    suit_keys: np.ndarray = (
+        _suit_key[board].sum()
+        + _suit_key[runouts].sum(axis=1)[:, None]
+        + _suit_key[combos].sum(axis=1)[None, :]
+    )
+    flush_suit: np.ndarray = _flush_suit[suit_keys]
+    rows, cols = np.nonzero(flush_suit >= 0)
+    if rows.size:
+        suit: np.ndarray = flush_suit[rows, cols]
+        masks: np.ndarray = _suit_bits(board)[suit] | _suit_bits(runouts)[rows, suit]
+        masks |= _suit_bits(combos)[cols, suit]
+        strengths[rows, cols] = _flush_places[masks]
+
+    return strengths
+
+
+def _dense_ranks(strengths: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Each strength replaced by its place among the distinct strengths of its runout (row), and
+    how many distinct strengths each runout has, rarely more than ~150.
+    """
+    rows: np.ndarray = np.arange(len(strengths))[:, None]
+    present: np.ndarray = np.zeros((len(strengths), len(_strength_values)), dtype=bool)
+    present[rows, strengths] = True
+    dense: np.ndarray = np.cumsum(present, axis=1, dtype=np.int32)
+
+    return (dense[rows, strengths] - 1).astype(np.int64), dense[:, -1].astype(np.int64)
+
+
+@dataclass
+class _Bins:
+    """
+    Histograms over strength ranks, one per line (a runout, or a runout and a card), laid end to
+    end: keys holds each element's bin, lines its line, and starts[line] is where a line begins.
+    """
+
+    keys: np.ndarray
+    lines: np.ndarray
+    starts: np.ndarray
+    size: int
+
+    def midpoints(self, weights: np.ndarray) -> np.ndarray:
+        """
+        For every element, the weight in the lower bins of its line plus half the weight in its
+        own: the pot share it wins against that weight.
+        """
+        binned: np.ndarray = np.bincount(self.keys.ravel(), weights.ravel(), self.size)
+        below: np.ndarray = np.zeros(self.size + 1)
+        np.cumsum(binned, out=below[1:])
+        midpoints: np.ndarray = below[:-1] + binned / 2
+
+        return midpoints[self.keys] - below[self.starts][self.lines]
+
+
+def _against(
+    weights: np.ndarray, whole: _Bins, by_card: _Bins, incidence: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    weights: (runouts, combos) weight of one side's combos, zero where they're not in the range
+    or collide with the runout. For every combo, the pot share it wins against that side and the
+    weight of that side it can meet at all, per runout.
+    """
+    shares: np.ndarray = whole.midpoints(weights)
+    # the same over the combos holding each of its cards
+    held: np.ndarray = by_card.midpoints(np.broadcast_to(weights[:, :, None], by_card.keys.shape))
+
+    # the identical combo is a tie, taken out once per card
+    shares += weights / 2 - held[:, :, 0] - held[:, :, 1]
+    held_cards: np.ndarray = weights @ incidence
+    met: np.ndarray = weights.sum(axis=1, keepdims=True) - held_cards @ incidence.T + weights
+
+    return shares, met
+
+
+def _bins(ranks: np.ndarray, sizes: np.ndarray, cards: np.ndarray) -> tuple[_Bins, _Bins]:
+    """
+    Bins by (runout, strength rank), and by (runout, card, strength rank) for both cards of every
+    combo.
+    """
+    rows: np.ndarray = np.arange(len(ranks))[:, None]
+    starts: np.ndarray = np.concatenate(([0], np.cumsum(sizes)))
+    whole: _Bins = _Bins(starts[:-1, None] + ranks, rows, starts[:-1], int(starts[-1]))
+
+    card_starts: np.ndarray = (starts[:-1, None] * 52 + np.arange(52) * sizes[:, None]).ravel()
+    card_lines: np.ndarray = rows[:, :, None] * 52 + cards
+    by_card: _Bins = _Bins(
+        card_starts[card_lines] + ranks[:, :, None], card_lines, card_starts, int(starts[-1]) * 52
+    )
+
+    return whole, by_card
+
+
+def _range_result(
+    combos: np.ndarray, weights: np.ndarray, shares: np.ndarray, met: np.ndarray, scale: np.ndarray
+) -> RangeEquity:
+    """
+    shares and met per combo, summed over runouts; scale is how much each combo counts towards
+    the range's equity.
+    """
+    seen: np.ndarray = met > 0
+    total: float = float((scale * met).sum())
+    return RangeEquity(
+        float((scale * shares).sum()) / total if total else 0.0,
+        [
+            ComboEquity(combo_cards(int(i)), float(w), float(s / m))
+            for i, w, s, m in zip(combos[seen], weights[seen], shares[seen], met[seen])
+        ],
+    )
+
+
+def _exact_heads_up(
+    combos: list[np.ndarray], weights: list[np.ndarray], board: np.ndarray, runouts: np.ndarray
+) -> list[RangeEquity]:
+    union, inverse = np.unique(np.concatenate(combos), return_inverse=True)
+    columns: list[np.ndarray] = np.split(inverse, [len(combos[0])])
+    cards: np.ndarray = COMBOS[union]
+    incidence: np.ndarray = np.zeros((len(union), 52))
+    incidence[np.arange(len(union))[:, None], cards] = 1.0
+    sides: list[np.ndarray] = []
+    for villain in (1, 0):
+        side: np.ndarray = np.zeros(len(union))
+        side[columns[villain]] = weights[villain]
+        sides.append(side)
+
+    shares: list[np.ndarray] = [np.zeros(len(c)) for c in combos]
+    met: list[np.ndarray] = [np.zeros(len(c)) for c in combos]
+    # in chunks of runouts, to bound the (runout, card, strength rank) bins
+    for start in range(0, len(runouts), RUNOUT_CHUNK):
+        chunk: np.ndarray = runouts[start : start + RUNOUT_CHUNK]
+        whole, by_card = _bins(*_dense_ranks(_strengths(board, chunk, cards)), cards)
+        run_masks: np.ndarray = np.bitwise_or.reduce(np.left_shift(1, chunk), axis=1)
+        valid: np.ndarray = (run_masks[:, None] & COMBO_MASKS[union][None, :]) == 0
+        for hero, side in enumerate(sides):
+            chunk_shares, chunk_met = _against(side * valid, whole, by_card, incidence)
+            hero_valid: np.ndarray = valid[:, columns[hero]]
+            shares[hero] += (chunk_shares[:, columns[hero]] * hero_valid).sum(axis=0)
+            met[hero] += (chunk_met[:, columns[hero]] * hero_valid).sum(axis=0)
+
+    if not met[0].any():
+        raise ValueError("The ranges have no combos that can be dealt together")
+
+    return [
+        _range_result(combos[hero], weights[hero], shares[hero], met[hero], weights[hero])
+        for hero in (0, 1)
+    ]
+
+
+def _sampled(
+    combos: list[np.ndarray],
+    weights: list[np.ndarray],
+    board: np.ndarray,
+    deck: np.ndarray,
+    samples: int,
+    rng: np.random.Generator,
+) -> list[RangeEquity]:
+    players: int = len(combos)
+    missing: int = 5 - len(board)
+    shares: list[np.ndarray] = [np.zeros(len(c)) for c in combos]
+    dealt: list[np.ndarray] = [np.zeros(len(c)) for c in combos]
+    accepted: int = 0
+    while accepted < samples:
+        batch: int = max(samples - accepted, 1024)
+        picks: np.ndarray = np.stack(
+            [rng.choice(len(c), batch, p=w / w.sum()) for c, w in zip(combos, weights)], axis=1
+        )
+        hands: np.ndarray = np.stack([c[p] for c, p in zip(combos, picks.T)], axis=1)
+        runout: np.ndarray = deck[np.argsort(rng.random((batch, len(deck))), axis=1)[:, :missing]]
+
+        # a deal is possible only if no card appears twice
+        cards: np.ndarray = np.concatenate(
+            [COMBOS[hands].reshape(batch, 2 * players), runout], axis=1
+        )
+        ok: np.ndarray = np.sort(cards, axis=1)
+        ok = (np.diff(ok, axis=1) != 0).all(axis=1)
+        ok &= np.cumsum(ok) <= samples - accepted
+        if not ok.any():
+            raise ValueError("The ranges have no combos that can be dealt together")
+        hands, picks, runout = hands[ok], picks[ok], runout[ok]
+        accepted += len(hands)
+
+        rows: np.ndarray = np.concatenate(
+            [
+                COMBOS[hands].reshape(-1, 2),
+                np.broadcast_to(board, (len(hands) * players, len(board))),
+                np.repeat(runout, players, axis=0),
+            ],
+            axis=1,
+        )
+        strengths: np.ndarray = evaluate_batch(rows).reshape(-1, players)
+        winners: np.ndarray = strengths == strengths.max(axis=1, keepdims=True)
+        share: np.ndarray = winners / winners.sum(axis=1, keepdims=True)
+        for player in range(players):
+            shares[player] += np.bincount(picks[:, player], share[:, player], len(combos[player]))
+            dealt[player] += np.bincount(picks[:, player], minlength=len(combos[player]))
+
+    # the draws already follow the weights, so every deal counts once
+    return [
+        _range_result(c, w, s, d, np.ones(len(c)))
+        for c, w, s, d in zip(combos, weights, shares, dealt)
+    ]
+
+
+def range_equity(
+    ranges: list[Union[str, Range]],
+    board: Optional[list[Card]] = None,
+    dead: Optional[list[Card]] = None,
+    *,
+    max_runouts: int = MAX_RUNOUTS,
+    samples: int = SAMPLES,
+    seed: Optional[int] = None,
+) -> RangeEquityResult:
+    """
+    Equity of each range against the others, and of every combo in it. Heads-up it is exact over
+    every runout unless there are more than max_runouts (preflop), in which case that many are
+    drawn; three or more ranges are estimated from samples deals.
+    """
+    board = board or []
+    dead = dead or []
+    if not 2 <= len(ranges) <= 9:
+        raise ValueError("Range equity needs between 2 and 9 ranges")
+    if len(board) not in (0, 3, 4, 5):
+        raise ValueError("Board must be empty, a flop, a turn or a river")
+
+    known: np.ndarray = np.array([c.id for c in board + dead], dtype=np.int64)
+    if len(set(known.tolist())) != len(known):
+        raise ValueError("The same card appears more than once")
+
+    known_mask: int = sum(1 << int(i) for i in known)
+    combos: list[np.ndarray] = []
+    weights: list[np.ndarray] = []
+    for spec in ranges:
+        parsed: Range = parse_range(spec) if isinstance(spec, str) else spec
+        live: np.ndarray = np.flatnonzero((parsed.weights > 0) & ((COMBO_MASKS & known_mask) == 0))
+        if not live.size:
+            raise ValueError(f"Range {parsed.text or '?'!r} has no combos left on this board")
+        combos.append(live)
+        weights.append(parsed.weights[live])
+
+    rng: np.random.Generator = np.random.default_rng(seed)
+    board_ids: np.ndarray = known[: len(board)]
+    deck: np.ndarray = np.setdiff1d(np.arange(52), known)
+    if len(ranges) > 2:
+        results: list[RangeEquity] = _sampled(combos, weights, board_ids, deck, samples, rng)
+        return RangeEquityResult(results, samples, False)
+
+    runouts, exact = _runouts(deck, 5 - len(board), max_runouts, rng)
+    results = _exact_heads_up(combos, weights, board_ids, runouts)
+    return RangeEquityResult(results, len(runouts), exact)
@@ -0,0 +1,146 @@
+"""
+Room bookkeeping for the server: rooms by id plus connection -> room and player -> room indexes,
+so finding a socket's room is a dict lookup and leaving a room cleans up after itself.
+"""
+
+from __future__ import annotations
+import asyncio
+from dataclasses import dataclass, field
+from itertools import count
+from typing import TYPE_CHECKING, Callable, Iterator, Optional
+from delta import TableStream
+from main import Action, Player, Table
+
+if TYPE_CHECKING:
+    import websockets
+
+
+@dataclass
+class Room:
+    id: int
+    table: Table
+    player_socks: dict[websockets.ServerConnection, Player]
+    host: Player
+    # actions typed by each player, consumed by the room's game task
+    queues: dict[Player, asyncio.Queue[Action]] = field(default_factory=dict)
+    game: Optional[asyncio.Task] = None
+    # connections watching the table without a seat
+    spectators: set[websockets.ServerConnection] = field(default_factory=set)
+    stream: TableStream = field(init=False)
+
+    def __post_init__(self):
+        self.stream = TableStream(self.table)
+
+    def audience(self) -> list[websockets.ServerConnection]:
+        return [*self.player_socks, *self.spectators]
+
+
+class RoomRegistry:
+    """
+    Room ids come from a counter and are never reused. A room is evicted as soon as its last
+    player leaves, and any hand still running in it is cancelled. Spectators don't keep a room
+    alive.
+    """
+
+    def __init__(self, table_factory: Callable[[], Table] = lambda: Table(10, 20)):
+        self.table_factory: Callable[[], Table] = table_factory
+        self.rooms: dict[int, Room] = {}
+        self._ids: Iterator[int] = count(1)
+        self._by_conn: dict[websockets.ServerConnection, Room] = {}
+        self._by_player: dict[Player, Room] = {}
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def __contains__(self, room_id: int) -> bool:
+        return room_id in self.rooms
+
+    def __iter__(self) -> Iterator[Room]:
+        return iter(list(self.rooms.values()))
+
+    def create(
+        self, ws: websockets.ServerConnection, player: Player, room_id: Optional[int] = None
+    ) -> Room:
+        """
+        Opens a room hosted by the player. The id comes from the counter unless given, as it is
+        when another process hands out the ids.
+        """
+        self._check_unseated(ws, player)
+        if room_id is None:
+            room_id = next(self._ids)
+        elif room_id in self.rooms:
+            raise ValueError(f"room {room_id} already exists")
+        room: Room = Room(room_id, self.table_factory(), {ws: player}, player)
+        self.rooms[room.id] = room
+        self._by_conn[ws] = room
+        self._by_player[player] = room
+
+        return room
+
+    def join(self, room_id: int, ws: websockets.ServerConnection, player: Player) -> Room:
+        self._check_unseated(ws, player)
+        room: Room = self.rooms[room_id]
+        room.player_socks[ws] = player
+        self._by_conn[ws] = room
+        self._by_player[player] = room
+
+        return room
+
+    def watch(self, room_id: int, ws: websockets.ServerConnection) -> Room:
+        if ws in self._by_conn:
+            raise ValueError("connection is already in a room")
+        room: Room = self.rooms[room_id]
+        room.spectators.add(ws)
+        self._by_conn[ws] = room
+
+        return room
+
+    def room_of(self, ws: websockets.ServerConnection) -> Optional[Room]:
+        return self._by_conn.get(ws)
+
+    def room_of_player(self, player: Player) -> Optional[Room]:
+        return self._by_player.get(player)
+
+    def leave(self, ws: websockets.ServerConnection) -> Optional[Room]:
+        """
+        Removes the connection's player (or spectator) from their room. Hands the room to another
+        player if the host left, and evicts the room if no players are left. Returns the room that
+        was left.
+        """
+        room: Optional[Room] = self._by_conn.pop(ws, None)
+        if room is None:
+            return None
+        if ws in room.spectators:
+            room.spectators.discard(ws)
+            return room
+
+        player: Player = room.player_socks.pop(ws)
+        self._by_player.pop(player, None)
+
+        if not room.player_socks:
+            del self.rooms[room.id]
+            for spectator in room.spectators:
+                self._by_conn.pop(spectator, None)
+            room.stream.close()
+            if room.game is not None:
+                room.game.cancel()
+        elif room.host is player:
+            room.host = next(iter(room.player_socks.values()))
+
+        return room
+
+    def clear(self):
+        """
+        Drops every room and starts numbering from 1 again.
+        """
+        for room in self.rooms.values():
+            if room.game is not None:
+                room.game.cancel()
+        self.rooms.clear()
+        self._by_conn.clear()
+        self._by_player.clear()
+        self._ids = count(1)
+
+    def _check_unseated(self, ws: websockets.ServerConnection, player: Player):
+        if ws in self._by_conn or player in self._by_player:
+            raise ValueError(f"{player} is already in a room")
@@ -1,127 +1,368 @@
 import asyncio
 import websockets
-from dataclasses import dataclass
-from main import Player, Table
+from main import Action, Player, Table, strength_rank
+from delta import Delta
+from history import HistoryWriter
+from registry import Room, RoomRegistry
+from broadcast import Broadcaster
+import eventlog
+import metrics
+from protocol import (
+    BINARY_SUBPROTOCOL,
+    Codec,
+    Message,
+    MsgType,
+    Payload,
+    codec_for,
+    message_action,
+)
 import logging
-from typing import Optional
+import os
+from typing import Iterable, Optional, Sequence
+from urllib.parse import SplitResult, parse_qs, urlsplit
 
-connected = set()
+log: logging.Logger = logging.getLogger("poker.server")
 
-logging.basicConfig(
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
+
+registry: RoomRegistry = RoomRegistry()
+broadcaster: Broadcaster = Broadcaster()
+# finished hands are appended here when POKER_HISTORY_DIR is set
+history: Optional[HistoryWriter] = None
+# how each connection talks: binary frames if it asked for the binary subprotocol, text otherwise
+codecs: dict[websockets.ServerConnection, Codec] = {}
+# set in cluster workers, whose connections arrive from the router with the room already chosen
+routed: bool = False
+
+metrics.gauges["connections_open"] = lambda: len(codecs)
+metrics.gauges["rooms_open"] = lambda: len(registry)
+
+
+def send(ws: websockets.ServerConnection, message: Message) -> bool:
+    codec: Optional[Codec] = codecs.get(ws)
+    return codec is not None and broadcaster.send(ws, codec.encode(message))
+
+
+def broadcast(
+    conns: Iterable[websockets.ServerConnection],
+    message: Message,
+    exclude: Optional[websockets.ServerConnection] = None,
+):
+    # encode once per codec, not once per connection
+    frames: dict[int, Payload] = {}
+    for ws in conns:
+        codec: Optional[Codec] = codecs.get(ws)
+        if ws is exclude or codec is None:
+            continue
+        if id(codec) not in frames:
+            frames[id(codec)] = codec.encode(message)
+        broadcaster.send(ws, frames[id(codec)])
+
+
+async def receive(ws: websockets.ServerConnection, expected: MsgType) -> Message:
+    """
+    Waits for a message of the expected type, asking again after anything else.
+    """
+    while True:
+        message: Optional[Message] = codecs[ws].decode(await ws.recv(), expected)
+        if message is not None:
+            return message
+        send(ws, Message(MsgType.ERROR, text="Invalid option. Please try again."))
+
+
+def publish(room: Room):
+    """
+    Sends the room's table changes since the last publish to everyone watching it.
+    """
+    delta: Optional[Delta] = room.stream.flush()
+    if delta is not None:
+        broadcast(room.audience(), Message(MsgType.DELTA, (delta.seq,), changes=delta.changes))
+
+
+def send_state(ws: websockets.ServerConnection, room: Room, since: Optional[int] = None):
+    """
+    Brings one connection up to date: the deltas after `since` if the room still has them, a full
+    snapshot otherwise.
+    """
+    publish(room)
+    deltas: Optional[list[Delta]] = None if since is None else room.stream.since(since)
+    if deltas is None:
+        snapshot: Delta = room.stream.snapshot()
+        send(ws, Message(MsgType.SNAPSHOT, (snapshot.seq,), changes=snapshot.changes))
+        return
+
+    for delta in deltas:
+        send(ws, Message(MsgType.DELTA, (delta.seq,), changes=delta.changes))
 
 
-@dataclass
-class Room:
-    id: int
-    table: Table
-    player_socks: dict[websockets.ServerConnection, Player]
-    host: Player
+async def run_game(room: Room):
+    """
+    Plays one hand in the room as its own task. Betting awaits each player's queue, so a slow
+    player only holds up their own table.
+    """
+    table: Table = room.table
+    socks: dict[Player, websockets.ServerConnection] = {
+        player: sock for sock, player in room.player_socks.items()
+    }
+    table.update(table, "players", list(socks))
+    room.queues = {player: asyncio.Queue() for player in socks}
+    dealt: bool = False
+    ranked: Optional[tuple[int, ...]] = None
 
+    def sync():
+        # hole cards go to their owner once, their made hand once per street, everything public
+        # goes out as a delta
+        nonlocal dealt, ranked
+        if not dealt:
+            for seat, player in enumerate(table.players):
+                cards = tuple(card.id for card in player.hand)
+                send(socks[player], Message(MsgType.CARDS, (seat,), cards=cards))
+            dealt = True
+        if table.strength_board != ranked:
+            for player, strength in table.strengths.items():
+                rank: Message = Message(MsgType.HAND_RANK, (table.street, strength_rank(strength)))
+                send(socks[player], rank)
+            ranked = table.strength_board
+        publish(room)
 
-rooms: dict[int, Room] = {}
+    async def ask(table: Table, seat: int) -> Action:
+        player: Player = table.players[seat]
+        queue: asyncio.Queue[Action] = room.queues[player]
+        # drop anything typed out of turn
+        while not queue.empty():
+            queue.get_nowait()
+
+        sync()
+        turn: Message = Message(
+            MsgType.TURN, (seat, table.current_bet, table.pot_size), text=player.name
+        )
+        if not send(socks[player], turn):
+            return Action(4)
+
+        return await queue.get()
+
+    try:
+        await table.begin_game_async(ask)
+        sync()
+        if history is not None:
+            history.record(table)
+        for sock, player in list(room.player_socks.items()):
+            send(sock, Message(MsgType.HAND_OVER, (player.chips,), text=player.name))
+    except Exception:
+        log.exception("Game in room %d failed", room.id)
+    finally:
+        table.update(table, "dealer", (table.dealer + 1) % len(table.players))
+        publish(room)
+        room.game = None
 
 
 async def handler(ws: websockets.ServerConnection):
-    await ws.send("Enter your name:")
-    name: str = str(await ws.recv())
-    player: Player = Player(name, 1000)
-    room_idx: int
-    print(f"{player} is connected")
-
-    if rooms:
-        while True:
-            await ws.send("Create (1) or join (2) a room?")
-            create_or_join: int = int(await ws.recv())
-
-            match create_or_join:
-                case 1:
-                    room_idx = len(rooms) + 1
-                    table: Table = Table(10, 20)
-                    current_player_sock: dict[websockets.ServerConnection, Player] = {
-                        ws: player
-                    }
-                    host: Player = player
-                    new_room: Room = Room(room_idx, table, current_player_sock, host)
-                    rooms[room_idx] = new_room
-
-                    await ws.send(f"You are now the host of {room_idx}.")
-                    logging.info(f"{player} created {room_idx}")
-
-                case 2:
-                    for idx, room in enumerate(rooms, start=1):
-                        await ws.send(f"{idx}. {room}")
-
-                    room_choice_idx = int(await ws.recv())
-
-                    while room_choice_idx not in rooms:
-                        await ws.send("Room doesn't exist. Please choose a valid room.")
-                        room_choice_idx: int = int(await ws.recv())
-
-                    rooms[room_choice_idx].player_socks[ws] = player
-
-                    existing_players_socks: list[websockets.ServerConnection] = [
-                        sock for sock in rooms[room_choice_idx].player_socks
-                    ]
-
-                    logging.info(f"{player} joined room {room_choice_idx}")
-
-                    # broadcast a message to everyone in the room
-                    for socket in existing_players_socks:
-                        if socket is not ws:
-                            await socket.send(f"{player} has joined the room")
+    # every send goes through the outbox so a slow client never blocks anyone else's handler
+    broadcaster.attach(ws)
+    codecs[ws] = codec_for(ws.subprotocol)
+    metrics.count("connections")
+    try:
+        await play(ws)
+    finally:
+        del codecs[ws]
+        # whatever was queued last, e.g. an error, still reaches the client
+        await broadcaster.drain_and_detach(ws)
 
-                case _:
-                    await ws.send("Invalid option. Please try again.")
-                    continue
 
-            break
+CREATE = 1
+JOIN = 2
+WATCH = 3
+
+
+async def choose_room(ws: websockets.ServerConnection, player: Player) -> tuple[Room, int]:
+    """
+    Walks a new connection through the lobby menu and seats it (or lets it watch) in the room it
+    picks. Returns the room and how it was entered: CREATE, JOIN or WATCH. With no rooms open
+    there's nothing to choose and a room is created.
+    """
+    if not registry:
+        return registry.create(ws, player), CREATE
+
+    while True:
+        send(ws, Message(MsgType.ROOM_MENU))
+        create_or_join: int = (await receive(ws, MsgType.CHOICE)).values[0]
+
+        match create_or_join:
+            case 1:
+                return registry.create(ws, player), CREATE
+
+            case 2 | 3:
+                for room in registry:
+                    send(ws, Message(MsgType.ROOM, (room.id,), text=room.host.name))
+
+                room_choice_idx: int = (await receive(ws, MsgType.CHOICE)).values[0]
+
+                while room_choice_idx not in registry:
+                    send(
+                        ws,
+                        Message(
+                            MsgType.ERROR, text="Room doesn't exist. Please choose a valid room."
+                        ),
+                    )
+                    room_choice_idx = (await receive(ws, MsgType.CHOICE)).values[0]
+
+                if create_or_join == WATCH:
+                    return registry.watch(room_choice_idx, ws), WATCH
+                return registry.join(room_choice_idx, ws, player), JOIN
+
+            case _:
+                send(ws, Message(MsgType.ERROR, text="Invalid option. Please try again."))
+
+
+def enter(ws: websockets.ServerConnection, player: Player, room: Room, how: int):
+    """
+    Tells the connection (and for a new player, the room) that it's in.
+    """
+    if how == CREATE:
+        metrics.count("rooms_created")
+        send(ws, Message(MsgType.ROOM_CREATED, (room.id,)))
+        log.info("%s created %d", player, room.id)
+        return
+
+    if how == WATCH:
+        log.info("%s is watching room %d", player, room.id)
     else:
-        room_idx = len(rooms) + 1
-        table: Table = Table(10, 20)
-        current_player_sock: dict[websockets.ServerConnection, Player] = {ws: player}
-        host: Player = player
-        new_room: Room = Room(room_idx, table, current_player_sock, host)
-        rooms[room_idx] = new_room
+        log.info("%s joined room %d", player, room.id)
+        # broadcast a message to everyone in the room
+        broadcast(room.player_socks, Message(MsgType.JOINED, text=player.name), exclude=ws)
+
+    # one full snapshot, then deltas from publish()
+    send_state(ws, room)
 
-        await ws.send(f"You are now the host of {room_idx}.")
-        logging.info(f"{player} created {room_idx}")
 
-    connected.add(ws)
+def routed_entry(ws: websockets.ServerConnection) -> Optional[tuple[Player, Room, int]]:
+    """
+    Behind the cluster router (see cluster.py) the lobby has already happened: the request path
+    says how to enter which room, as /<how>/<room id>?name=<name>. Returns None for anything else.
+    """
+    if ws.request is None:
+        return None
+    url: SplitResult = urlsplit(ws.request.path)
+    parts: list[str] = url.path.strip("/").split("/")
+    names: list[str] = parse_qs(url.query).get("name", [])
+    if len(parts) != 2 or not all(part.isdecimal() for part in parts) or len(names) != 1:
+        return None
+
+    how, room_id = int(parts[0]), int(parts[1])
+    player: Player = Player(names[0], 1000)
+    try:
+        match how:
+            case 1:
+                return player, registry.create(ws, player, room_id), CREATE
+            case 2:
+                return player, registry.join(room_id, ws, player), JOIN
+            case 3:
+                return player, registry.watch(room_id, ws), WATCH
+    except (KeyError, ValueError):
+        # the room closed (or was taken) between the router's lobby and this worker
+        pass
+
+    return None
+
+
+async def play(ws: websockets.ServerConnection):
+    entry: Optional[tuple[Player, Room, int]] = routed_entry(ws) if routed else None
+    if entry is not None:
+        player, room, how = entry
+    elif routed:
+        send(ws, Message(MsgType.ERROR, text="The room has closed."))
+        return
+    else:
+        send(ws, Message(MsgType.ASK_NAME))
+        name: str = (await receive(ws, MsgType.HELLO)).text
+        player = Player(name, 1000)
+        room, how = await choose_room(ws, player)
+    log.info("%s is connected", player)
+    enter(ws, player, room, how)
+
     try:
-        async for msg in ws:
-            print(f"{player} - {msg}")
-            match msg.strip():
-                case "start":
-                    await ws.send("Starting game...")
-                    # find the room the ws is in, add all the players from that room on the table,
-                    # then run the game
-                    target_room: Optional[Room] = None
-
-                    for room_idx in rooms:
-                        if ws in rooms[room_idx].player_socks:
-                            target_room = rooms[room_idx]
-                            break
-
-                    assert target_room is not None
-                    for player in target_room.player_socks.values():
-                        target_room.table.players.append(player)
-
-                    target_room.table.begin_game()
+        async for data in ws:
+            log.debug("%s - %r", player, data)
+            target_room: Optional[Room] = registry.room_of(ws)
+            if target_room is None:
+                # a spectator whose room closed
+                send(ws, Message(MsgType.ERROR, text="The room has closed."))
+                continue
+
+            message: Optional[Message] = codecs[ws].decode(data)
+            match message:
+                case Message(type=MsgType.RESYNC):
+                    send_state(ws, target_room, since=message.values[0])
+
+                case Message(type=MsgType.CHAT):
+                    # chat stays within the room
+                    broadcast(target_room.audience(), message, exclude=ws)
+
+                case _ if ws in target_room.spectators:
+                    send(ws, Message(MsgType.ERROR, text="Spectators can only chat."))
+
+                case Message(type=MsgType.START):
+                    if target_room.game is not None:
+                        send(ws, Message(MsgType.ERROR, text="A hand is already in progress."))
+                        continue
+
+                    if len(target_room.player_socks) < 2:
+                        send(ws, Message(MsgType.ERROR, text="Need at least two players to start."))
+                        continue
+
+                    send(ws, Message(MsgType.GAME_STARTED))
+                    # the hand runs as the room's own task so this handler keeps reading actions
+                    target_room.game = asyncio.create_task(run_game(target_room))
+
+                case Message(type=MsgType.ACTION) if (
+                    target_room.game is not None and player in target_room.queues
+                ):
+                    action: Optional[Action] = message_action(message)
+                    if action is not None:
+                        target_room.queues[player].put_nowait(action)
+                        continue
+
+                    send(ws, Message(MsgType.ERROR, text="Invalid action."))
+
+                case Message(type=MsgType.ACTION) if not codecs[ws].binary:
+                    # text that reads like an action is just chat when no hand is running
+                    chat: Message = Message(MsgType.CHAT, text=str(data))
+                    broadcast(target_room.audience(), chat, exclude=ws)
 
                 case _:
-                    for conn in connected:
-                        if conn != ws:
-                            await conn.send(msg)
+                    send(ws, Message(MsgType.ERROR, text="Unexpected message."))
     finally:
-        # TODO: find the player in the Room and remove them
-        connected.remove(ws)
+        # fold a player who leaves mid-hand so the rest of the table isn't stuck waiting
+        target_room = registry.leave(ws)
+        if target_room is not None and player in target_room.queues:
+            target_room.queues[player].put_nowait(Action(4))
+
+
+def select_subprotocol(
+    ws: websockets.ServerConnection, subprotocols: Sequence[websockets.Subprotocol]
+) -> Optional[websockets.Subprotocol]:
+    # clients that don't ask for the binary protocol still get in, in text mode
+    if BINARY_SUBPROTOCOL in subprotocols:
+        return websockets.Subprotocol(BINARY_SUBPROTOCOL)
+    return None
 
 
 async def main():
-    async with websockets.serve(handler, "localhost", 8765):
-        await asyncio.Future()  # run forever
+    global history
+    eventlog.configure_from_env()
+    if "POKER_HISTORY_DIR" in os.environ:
+        history = HistoryWriter(os.environ["POKER_HISTORY_DIR"], "server")
+    if "POKER_METRICS_PORT" in os.environ:
+        await metrics.serve(port=int(os.environ["POKER_METRICS_PORT"]))
+
+    try:
+        async with websockets.serve(
+            handler, "localhost", 8765, select_subprotocol=select_subprotocol
+        ):
+            await asyncio.Future()  # run forever
+    finally:
+        if history is not None:
+            history.close()
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,242 @@
+"""
+A fixed-size hash table in shared memory, so results one process computed are reused by every
+other process on the machine. Keys and values are short byte strings; callers pick the encoding
+(equity.py keys by canonical card ids).
+
+    header  magic "PKSC" | version (u16) | key size (u16) | value size (u16) | reserved (u16)
+            | slots (u32) | clock (u32)
+    slot    seq (u32) | stamp (u32) | key hash (u32) | key length (u8) | value length (u16)
+            | pad (u8) | key | value
+
+Open addressing: a key lives in one of the PROBE slots after crc32(key) % slots. Reads take no
+lock. Each slot has a sequence number that a writer makes odd while it rewrites the slot and even
+again afterwards (a seqlock), and a reader that sees it change, or odd, treats the slot as a miss.
+Writers serialize on a file lock next to the segment, so unrelated processes can attach by name.
+
+Eviction: when all PROBE slots of a key are taken, the insert replaces the one used least
+recently. Every hit and insert stamps its slot with a shared clock, so that is an LRU over an
+8-slot window. Memory is fixed at creation, however many processes use it.
+"""
+
+from __future__ import annotations
+import fcntl
+import os
+import struct
+import sys
+import tempfile
+import threading
+import zlib
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Optional
+
+MAGIC = b"PKSC"
+VERSION = 1
+PROBE = 8
+
+DEFAULT_SLOTS = 1 << 15
+DEFAULT_KEY_SIZE = 40
+DEFAULT_VALUE_SIZE = 232
+
+_HEADER = struct.Struct("<4sHHHHII")
+_CLOCK = struct.Struct("<I")
+_CLOCK_OFFSET = _HEADER.size - _CLOCK.size
+_SLOT = struct.Struct("<IIIBHx")
+_SEQ = struct.Struct("<I")
+_STAMP = struct.Struct("<I")
+
+
+def _lock_path(name: str) -> Path:
+    return Path(tempfile.gettempdir()) / f"{name}.lock"
+
+
+def _skip_registration(name: object, rtype: str):
+    pass
+
+
+def _attach_untracked(name: str) -> SharedMemory:
+    # Only the creator owns the segment. Before Python 3.13 (track=False) attaching registers it
+    # with the resource tracker, which unlinks it when the attaching process exits, and
+    # unregistering afterwards would drop the creator's registration when they share a tracker.
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name, track=False)  # type: ignore[call-arg]
+
+    register = resource_tracker.register
+    resource_tracker.register = _skip_registration
+    try:
+        return SharedMemory(name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedCache:
+    """
+    Create one with SharedCache.create(), then SharedCache.attach(cache.name) in any other
+    process. The creator should unlink() it when everyone is done.
+    """
+
+    def __init__(self, shm: SharedMemory, owner: bool):
+        if shm.buf is None:
+            raise ValueError(f"{shm.name} is closed")
+        self.shm: SharedMemory = shm
+        self.owner: bool = owner
+        self.name: str = shm.name
+        magic, version, key_size, value_size, _, slots, _ = _HEADER.unpack_from(shm.buf)
+        if (magic, version) != (MAGIC, VERSION):
+            raise ValueError(f"{shm.name} is not a version {VERSION} shared cache")
+
+        self.key_size: int = key_size
+        self.value_size: int = value_size
+        self.slots: int = slots
+        self.slot_size: int = (_SLOT.size + key_size + value_size + 7) & ~7
+        self.hits: int = 0
+        self.misses: int = 0
+        self._buf: memoryview = shm.buf
+        self._lock_file = open(_lock_path(self.name), "a+b")
+        # fcntl locks belong to the process, so threads of one process also need this
+        self._thread_lock: threading.Lock = threading.Lock()
+
+    @classmethod
+    def create(
+        cls,
+        name: Optional[str] = None,
+        slots: int = DEFAULT_SLOTS,
+        key_size: int = DEFAULT_KEY_SIZE,
+        value_size: int = DEFAULT_VALUE_SIZE,
+    ) -> SharedCache:
+        if slots < PROBE or key_size > 255 or value_size > 0xFFFF:
+            raise ValueError(f"need {PROBE}+ slots, keys up to 255 and values up to 65535 bytes")
+
+        slot_size: int = (_SLOT.size + key_size + value_size + 7) & ~7
+        shm: SharedMemory = SharedMemory(name, create=True, size=_HEADER.size + slots * slot_size)
+        assert shm.buf is not None  # only None once closed
+        # fresh shared memory is zeroed: every slot starts empty with an even seq
+        _HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, key_size, value_size, 0, slots, 0)
+
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> SharedCache:
+        return cls(_attach_untracked(name), owner=False)
+
+    def __enter__(self) -> SharedCache:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        if self.owner:
+            self.unlink()
+
+    def __getstate__(self):
+        # processes get their own attachment rather than a copy of this one
+        return self.name
+
+    def __setstate__(self, name: str):
+        other: SharedCache = SharedCache.attach(name)
+        self.__dict__.update(other.__dict__)
+
+    def _offset(self, slot: int) -> int:
+        return _HEADER.size + slot * self.slot_size
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        """
+        The value stored under key, or None. Never blocks.
+        """
+        buf: memoryview = self._buf
+        key_hash: int = zlib.crc32(key)
+        start: int = key_hash % self.slots
+        for probe in range(PROBE):
+            offset: int = self._offset((start + probe) % self.slots)
+            seq, _, slot_hash, key_len, value_len = _SLOT.unpack_from(buf, offset)
+            if seq & 1 or slot_hash != key_hash or key_len != len(key):
+                continue
+
+            key_at: int = offset + _SLOT.size
+            if buf[key_at : key_at + key_len] != key:
+                continue
+            value_at: int = key_at + self.key_size
+            value: bytes = bytes(buf[value_at : value_at + value_len])
+            if _SEQ.unpack_from(buf, offset)[0] != seq:
+                break  # rewritten while we read it
+
+            # a racy stamp only makes eviction slightly less exact
+            _STAMP.pack_into(buf, offset + _SEQ.size, self._tick())
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key: bytes, value: bytes) -> bool:
+        """
+        Stores value under key, evicting the least recently used entry of the key's probe window
+        if it's full. Returns False (storing nothing) for an empty key or an oversized key or value.
+        """
+        if not 0 < len(key) <= self.key_size or len(value) > self.value_size:
+            return False
+
+        buf: memoryview = self._buf
+        key_hash: int = zlib.crc32(key)
+        start: int = key_hash % self.slots
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                victim: Optional[int] = None
+                oldest: int = 1 << 32
+                for probe in range(PROBE):
+                    offset: int = self._offset((start + probe) % self.slots)
+                    _, stamp, slot_hash, key_len, _ = _SLOT.unpack_from(buf, offset)
+                    key_at: int = offset + _SLOT.size
+                    if slot_hash == key_hash and buf[key_at : key_at + key_len] == key:
+                        victim = offset
+                        break
+                    if key_len == 0:
+                        if oldest >= 0:
+                            victim, oldest = offset, -1
+                    elif stamp < oldest:
+                        victim, oldest = offset, stamp
+
+                assert victim is not None
+                self._write(victim, key_hash, key, value)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+        return True
+
+    def _write(self, offset: int, key_hash: int, key: bytes, value: bytes):
+        buf: memoryview = self._buf
+        (seq,) = _SEQ.unpack_from(buf, offset)
+        _SEQ.pack_into(buf, offset, seq + 1)
+        key_at: int = offset + _SLOT.size
+        buf[key_at : key_at + len(key)] = key
+        value_at: int = key_at + self.key_size
+        buf[value_at : value_at + len(value)] = value
+        _SLOT.pack_into(buf, offset, seq + 1, self._tick(), key_hash, len(key), len(value))
+        _SEQ.pack_into(buf, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def _tick(self) -> int:
+        (clock,) = _CLOCK.unpack_from(self._buf, _CLOCK_OFFSET)
+        clock = (clock + 1) & 0xFFFFFFFF
+        _CLOCK.pack_into(self._buf, _CLOCK_OFFSET, clock)
+
+        return clock
+
+    def __len__(self) -> int:
+        return sum(
+            1
+            for slot in range(self.slots)
+            if _SLOT.unpack_from(self._buf, self._offset(slot))[3]
+        )
+
+    def close(self):
+        self._buf = memoryview(b"")
+        self._lock_file.close()
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+        try:
+            os.unlink(_lock_path(self.name))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,165 @@
+"""
+Headless hand simulation. Tables are driven by strategy callables instead of input(), with
+logging switched off, and hands are sharded across worker processes.
+"""
+
+from __future__ import annotations
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Sequence
+from history import HistoryWriter
+from main import Action, Deck, Player, Strategy, Table, rng_stream
+
+
+def check_call(table: Table, player_idx: int) -> Action:
+    return Action(1) if table.current_bet == 0 else Action(2)
+
+
+def loose_aggressive(table: Table, player_idx: int) -> Action:
+    """
+    Min-raises a quarter of the time when the stack allows it, otherwise checks or calls.
+    """
+    raise_amt: int = max(2 * table.current_bet, table.big_blind)
+    if raise_amt < table.players[player_idx].chips and table.deck.rng.random() < 0.25:
+        return Action(3, raise_amt)
+    return check_call(table, player_idx)
+
+
+def tight_passive(table: Table, player_idx: int) -> Action:
+    """
+    Folds to a bet a third of the time, otherwise checks or calls.
+    """
+    if table.current_bet > 0 and table.deck.rng.random() < 1 / 3:
+        return Action(4)
+    return check_call(table, player_idx)
+
+
+@dataclass
+class SimulationResult:
+    hands: int
+    seconds: float
+    net_chips: list[int]
+
+    @property
+    def hands_per_second(self) -> float:
+        return self.hands / self.seconds if self.seconds else 0.0
+
+
+def _run_shard(
+    strategies: Sequence[Strategy],
+    hands: int,
+    seed: Optional[int],
+    stream: int,
+    stack: int,
+    small_blind: int,
+    big_blind: int,
+    history_dir: Optional[str] = None,
+) -> list[int]:
+    """
+    Plays hands complete hands at one table and returns each seat's net chips. Stacks are reset
+    before every hand so nobody busts, and the button moves one seat per hand. With history_dir
+    every hand is also written to the hand history, under the prefix shard<stream>.
+    """
+    players: list[Player] = [Player(f"seat{i}", stack) for i in range(len(strategies))]
+    table: Table = Table(
+        small_blind,
+        big_blind,
+        players=players,
+        deck=Deck(rng=rng_stream(seed, stream)),
+        strategy=lambda t, idx: strategies[idx](t, idx),
+    )
+    net: list[int] = [0] * len(players)
+    history: Optional[HistoryWriter] = (
+        HistoryWriter(history_dir, f"shard{stream}") if history_dir is not None else None
+    )
+
+    try:
+        for _ in range(hands):
+            for p in players:
+                p.chips = stack
+            table.pre_game().pre_flop().flop().turn().river().showdown()
+            if history is not None:
+                history.record(table)
+            for i, p in enumerate(players):
+                net[i] += p.chips - stack
+            table.dealer = (table.dealer + 1) % len(players)
+    finally:
+        if history is not None:
+            history.close()
+
+    return net
+
+
+def _run_shard_quietly(*args) -> list[int]:
+    previous: int = logging.root.manager.disable
+    logging.disable(logging.CRITICAL)
+    try:
+        return _run_shard(*args)
+    finally:
+        logging.disable(previous)
+
+
+def simulate(
+    strategies: Sequence[Strategy],
+    hands: int,
+    *,
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+    stack: int = 1000,
+    small_blind: int = 10,
+    big_blind: int = 20,
+    history_dir: Optional[str] = None,
+) -> SimulationResult:
+    """
+    Plays hands hands with one strategy per seat. The hands are split into one shard per worker
+    process, each at its own table with its own RNG stream; workers=0 plays them in this process.
+    Strategies must be picklable (module-level functions) when workers are used. history_dir
+    records every hand to a hand history there (see history.py).
+    """
+    if not 2 <= len(strategies) <= 9:
+        raise ValueError("A table needs between 2 and 9 seats")
+
+    shards: int = max(1, workers if workers is not None else os.cpu_count() or 1)
+    sizes: list[int] = [hands // shards + (i < hands % shards) for i in range(shards)]
+    args = [
+        (strategies, size, seed, i, stack, small_blind, big_blind, history_dir)
+        for i, size in enumerate(sizes)
+        if size
+    ]
+
+    start: float = time.perf_counter()
+    if workers == 0:
+        results = [_run_shard_quietly(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=shards) as pool:
+            results = list(pool.map(_run_shard_quietly, *zip(*args)))
+    seconds: float = time.perf_counter() - start
+
+    net: list[int] = [sum(seat) for seat in zip(*results)] if results else [0] * len(strategies)
+    return SimulationResult(hands, seconds, net)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run headless poker hands")
+    parser.add_argument("--hands", type=int, default=100_000)
+    parser.add_argument("--seats", type=int, default=6)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--history", default=None, help="write every hand to this directory")
+    args = parser.parse_args()
+
+    pool_of_strategies: list[Strategy] = [check_call, loose_aggressive, tight_passive]
+    seat_strategies: list[Strategy] = [
+        pool_of_strategies[i % len(pool_of_strategies)] for i in range(args.seats)
+    ]
+    result = simulate(
+        seat_strategies, args.hands, workers=args.workers, seed=args.seed, history_dir=args.history
+    )
+
+    print(f"{result.hands} hands in {result.seconds:.2f}s ({result.hands_per_second:,.0f} hands/s)")
+    for i, (strategy, chips) in enumerate(zip(seat_strategies, result.net_chips)):
+        print(f"seat{i} {strategy.__name__}: {chips:+d}")